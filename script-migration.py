@@ -10,26 +10,950 @@ Versão: 4.0 - Corrigido problema de Foreign Key com Whatsapps
 
 import psycopg2
 import mysql.connector
+import argparse
+import atexit
+import copy
 import json
 import logging
+import logging.handlers
 import hashlib
+import math
+import os
+import pickle
+import queue
+import re
+import select
+import sqlite3
+import tempfile
+import threading
+import time
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 import sys
 import traceback
 
-# Configuração de logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('migration.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Configuração de logging: arquivo e console são escritos por uma thread
+# própria (QueueListener); o caminho quente só enfileira o registro
+_log_handlers = [
+    logging.FileHandler('migration.log'),
+    logging.StreamHandler(sys.stdout)
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+_log_queue = queue.SimpleQueue()
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # formato final no listener
+log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers)
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
-class DatabaseMigration:
+class _RawQueueHandler(logging.handlers.QueueHandler):
+    """Enfileira o registro sem formatar: a serialização fica na thread do listener"""
+    
+    def prepare(self, record):
+        return record
+
+class _JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'at': self.formatTime(record), **record.msg}
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+# Eventos de alto volume (detalhe completo) em arquivo estruturado separado
+_events_handler = logging.FileHandler('migration_events.jsonl', encoding='utf-8', delay=True)
+_events_handler.setFormatter(_JsonLinesFormatter())
+_events_queue = queue.SimpleQueue()
+events_listener = logging.handlers.QueueListener(_events_queue, _events_handler)
+events_logger = logging.getLogger('migration.events')
+events_logger.propagate = False
+events_logger.addHandler(_RawQueueHandler(_events_queue))
+events_listener.start()
+atexit.register(events_listener.stop)
+
+def flush_logs():
+    """Esvazia as filas de log (antes de prompts e do resumo final)"""
+    for listener in (log_listener, events_listener):
+        listener.stop()
+        listener.start()
+
+class EventSummary:
+    """Agrega eventos de alto volume em resumos periódicos no log principal
+    
+    Cada evento vai com todos os campos para migration_events.jsonl; o log
+    principal recebe apenas contagens a cada `interval` segundos.
+    """
+    
+    LABELS = {
+        'queue_created': 'filas criadas',
+        'duplicate_number': 'números duplicados renomeados',
+        'duplicate_email': 'emails duplicados renomeados',
+        'whatsapp_created': 'whatsapps criados',
+        'whatsapp_skipped': 'whatsapps já existentes ignorados',
+        'whatsapp_nulled': 'tickets com whatsappId anulado',
+    }
+    
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self.totals = {}
+        self._pending = {}
+        self._last_summary = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def record(self, kind, **fields):
+        events_logger.info({'event': kind, **fields})
+        with self._lock:
+            self.totals[kind] = self.totals.get(kind, 0) + 1
+            self._pending[kind] = self._pending.get(kind, 0) + 1
+            due = time.monotonic() - self._last_summary >= self.interval
+        if due:
+            self.flush()
+    
+    def flush(self):
+        """Registra no log principal as contagens acumuladas desde o último resumo"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_summary = time.monotonic()
+        if pending:
+            parts = [f"{count} {self.LABELS.get(kind, kind)}" for kind, count in pending.items()]
+            logger.info(f"📊 Eventos: {', '.join(parts)} (detalhes em migration_events.jsonl)")
+
+event_summary = EventSummary()
+
+class DiscardedEvents:
+    """No lugar do EventSummary quando as transformações só calculam o valor esperado"""
+    
+    def record(self, kind, **fields):
+        pass
+    
+    def flush(self):
+        pass
+
+def parse_size(value):
+    """Converte tamanhos como '512M' ou '2G' em bytes"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = str(value).strip().upper().rstrip('B')
+    try:
+        if text and text[-1] in units:
+            return int(float(text[:-1]) * units[text[-1]])
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Tamanho inválido: {value}")
+
+def format_size(num_bytes):
+    """Formata bytes em MB para os relatórios"""
+    return f"{num_bytes / 1024 ** 2:.1f} MB"
+
+class MemoryBudget:
+    """Orçamento de memória (RSS) aplicado pelo pipeline de migração"""
+    
+    def __init__(self, limit_bytes=None):
+        self.limit = limit_bytes
+        self.peak = 0
+    
+    def current_rss(self):
+        """RSS atual do processo em bytes"""
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            if resource:
+                return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            return 0
+    
+    def sample(self):
+        """Mede o RSS atual e atualiza o pico observado"""
+        rss = self.current_rss()
+        self.peak = max(self.peak, rss)
+        return rss
+    
+    def peak_rss(self):
+        """Pico de RSS do processo (o kernel conhece picos entre amostras)"""
+        if resource:
+            self.peak = max(self.peak, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+        return self.peak
+    
+    def pressure(self):
+        """Fração do orçamento em uso (0.0 quando não há orçamento)"""
+        rss = self.sample()
+        if not self.limit:
+            return 0.0
+        return rss / self.limit
+    
+    def scale(self, size, minimum=100):
+        """Reduz tamanhos de fetch/lote à medida que o RSS se aproxima do orçamento"""
+        pressure = self.pressure()
+        if pressure < 0.5:
+            return size
+        if pressure < 0.75:
+            return max(minimum, size // 2)
+        if pressure < 0.9:
+            return max(minimum, size // 4)
+        return minimum
+
+class SpillableSet:
+    """Conjunto de strings que migra para SQLite em disco sob pressão de memória"""
+    
+    CHECK_EVERY = 10000
+    
+    def __init__(self, budget, spill_threshold=0.75):
+        self.budget = budget
+        self.spill_threshold = spill_threshold
+        self._items = set()
+        self._db = None
+        self._path = None
+        self._has_none = False
+        self._adds = 0
+    
+    def __contains__(self, value):
+        if value is None:
+            return self._has_none
+        if self._db is None:
+            return value in self._items
+        row = self._db.execute("SELECT 1 FROM items WHERE value = ?", (value,)).fetchone()
+        return row is not None
+    
+    def add(self, value):
+        if value is None:
+            self._has_none = True
+            return
+        if self._db is None:
+            self._items.add(value)
+            self._adds += 1
+            if self._adds % self.CHECK_EVERY == 0 and self.budget.pressure() >= self.spill_threshold:
+                self._spill()
+        else:
+            self._db.execute("INSERT OR IGNORE INTO items (value) VALUES (?)", (value,))
+    
+    def _spill(self):
+        """Move o conjunto em memória para um índice SQLite temporário"""
+        fd, self._path = tempfile.mkstemp(prefix='migration_set_', suffix='.sqlite')
+        os.close(fd)
+        # Acesso serializado pelo lock de deduplicação (consolidação usa várias threads)
+        self._db = sqlite3.connect(self._path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = OFF")
+        self._db.execute("PRAGMA synchronous = OFF")
+        self._db.execute("CREATE TABLE items (value TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._db.execute("BEGIN")
+        self._db.executemany("INSERT OR IGNORE INTO items (value) VALUES (?)", ((v,) for v in self._items))
+        self._db.execute("COMMIT")
+        logger.info(f"💾 Conjunto de deduplicação com {len(self._items)} itens movido para disco ({self._path})")
+        self._items = set()
+    
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            os.remove(self._path)
+            self._db = None
+
+class SpilledRows:
+    """Lista de linhas somente-anexação gravada em arquivo temporário (pickle)"""
+    
+    def __init__(self, name):
+        self._file = tempfile.TemporaryFile(prefix=f'migration_{name}_')
+        self._count = 0
+    
+    def append(self, row):
+        pickle.dump(row, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._count += 1
+    
+    def __len__(self):
+        return self._count
+    
+    def __iter__(self):
+        self._file.seek(0)
+        for _ in range(self._count):
+            yield pickle.load(self._file)
+        self._file.seek(0, os.SEEK_END)
+
+class RejectLog:
+    """Arquivo JSONL com as linhas rejeitadas na carga e o erro de cada uma"""
+    
+    def __init__(self, path='migration_rejects.jsonl'):
+        self.path = path
+        self.counts = {}
+        self._file = None
+        self._lock = threading.Lock()
+    
+    def record(self, table, row, error):
+        with self._lock:
+            if self._file is None:
+                # Reaberto após close() (replicação após a carga): acrescenta
+                self._file = open(self.path, 'a' if self.counts else 'w', encoding='utf-8')
+            entry = {
+                'table': table,
+                'error': str(error),
+                'row': list(row),
+                'rejectedAt': datetime.now().isoformat()
+            }
+            self._file.write(json.dumps(entry, default=str, ensure_ascii=False) + '\n')
+            self._file.flush()
+            self.counts[table] = self.counts.get(table, 0) + 1
+    
+    def total(self):
+        return sum(self.counts.values())
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# Erros do cliente MySQL que indicam conexão perdida
+MYSQL_CONNECTION_ERRNOS = (2006, 2013, 2055)
+
+class TargetDriver:
+    """Backend de driver para o MariaDB de destino"""
+    
+    name = None
+    
+    def connect(self, config):
+        raise NotImplementedError
+    
+    def cursor(self, conn, streaming=False):
+        return conn.cursor()
+    
+    def insert_cursor(self, conn):
+        return conn.cursor()
+    
+    def is_connected(self, conn):
+        raise NotImplementedError
+    
+    def error_code(self, error):
+        if getattr(error, 'errno', None) is not None:
+            return error.errno
+        if error.args and isinstance(error.args[0], int):
+            return error.args[0]
+        return None
+    
+    def describe(self):
+        return self.name
+
+class MysqlConnectorDriver(TargetDriver):
+    """mysql-connector-python, com extensão C e cursores preparados (protocolo binário) opcionais"""
+    
+    def __init__(self, name, use_pure=False, prepared=False):
+        self.name = name
+        self.use_pure = use_pure
+        self.prepared = prepared
+    
+    def connect(self, config):
+        conn = mysql.connector.connect(**config, use_pure=self.use_pure)
+        conn.autocommit = False
+        return conn
+    
+    def insert_cursor(self, conn):
+        if self.prepared:
+            return conn.cursor(prepared=True)
+        return conn.cursor()
+    
+    def is_connected(self, conn):
+        return conn.is_connected()
+    
+    def describe(self):
+        cext = getattr(mysql.connector, 'HAVE_CEXT', False) and not self.use_pure
+        details = ['extensão C' if cext else 'Python puro']
+        if self.prepared:
+            details.append('prepared')
+        return f"{self.name} ({', '.join(details)})"
+
+class MysqlclientDriver(TargetDriver):
+    """mysqlclient (MySQLdb), binding C da libmysqlclient/libmariadb"""
+    
+    name = 'mysqlclient'
+    
+    def __init__(self):
+        try:
+            import MySQLdb
+            import MySQLdb.cursors
+        except ImportError:
+            raise RuntimeError("Driver 'mysqlclient' requer o pacote mysqlclient (pip install mysqlclient)")
+        self.module = MySQLdb
+    
+    def connect(self, config):
+        conn = self.module.connect(
+            host=config['host'],
+            port=config['port'],
+            user=config['user'],
+            password=config['password'],
+            database=config['database'],
+            charset='utf8mb4'
+        )
+        conn.autocommit(False)
+        return conn
+    
+    def cursor(self, conn, streaming=False):
+        # O cursor padrão traz o resultado inteiro para a memória
+        if streaming:
+            return conn.cursor(self.module.cursors.SSCursor)
+        return conn.cursor()
+    
+    def is_connected(self, conn):
+        try:
+            conn.ping()
+            return True
+        except self.module.Error:
+            return False
+
+class PyMySQLDriver(TargetDriver):
+    """PyMySQL, driver em Python puro"""
+    
+    name = 'pymysql'
+    
     def __init__(self):
+        try:
+            import pymysql
+            import pymysql.cursors
+        except ImportError:
+            raise RuntimeError("Driver 'pymysql' requer o pacote PyMySQL (pip install PyMySQL)")
+        self.module = pymysql
+    
+    def connect(self, config):
+        return self.module.connect(
+            host=config['host'],
+            port=config['port'],
+            user=config['user'],
+            password=config['password'],
+            database=config['database'],
+            charset='utf8mb4',
+            autocommit=False
+        )
+    
+    def cursor(self, conn, streaming=False):
+        if streaming:
+            return conn.cursor(self.module.cursors.SSCursor)
+        return conn.cursor()
+    
+    def is_connected(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except self.module.Error:
+            return False
+
+TARGET_DRIVERS = {
+    'mysql-connector': lambda: MysqlConnectorDriver('mysql-connector'),
+    'mysql-connector-prepared': lambda: MysqlConnectorDriver('mysql-connector-prepared', prepared=True),
+    'mysql-connector-pure': lambda: MysqlConnectorDriver('mysql-connector-pure', use_pure=True),
+    'mysqlclient': MysqlclientDriver,
+    'pymysql': PyMySQLDriver,
+}
+
+def get_target_driver(name):
+    """Instancia o backend de driver do MariaDB pelo nome"""
+    if name not in TARGET_DRIVERS:
+        raise ValueError(f"Driver desconhecido: {name} (opções: {', '.join(TARGET_DRIVERS)})")
+    return TARGET_DRIVERS[name]()
+
+class TargetConnection:
+    """Conexão com o MariaDB com a mesma interface para qualquer driver"""
+    
+    def __init__(self, driver, raw):
+        self.driver = driver
+        self.raw = raw
+    
+    def cursor(self, streaming=False):
+        return self.driver.cursor(self.raw, streaming)
+    
+    def insert_cursor(self):
+        """Cursor para cargas em lote (preparado quando o driver suporta)"""
+        return self.driver.insert_cursor(self.raw)
+    
+    def commit(self):
+        self.raw.commit()
+    
+    def rollback(self):
+        self.raw.rollback()
+    
+    def close(self):
+        self.raw.close()
+    
+    def is_connected(self):
+        return self.driver.is_connected(self.raw)
+    
+    def is_connection_error(self, error):
+        return self.driver.error_code(error) in MYSQL_CONNECTION_ERRNOS
+
+class IdRemap:
+    """Mapa id de origem → id de destino apoiado em array (8 bytes por id de origem)"""
+    
+    def __init__(self, name):
+        self.name = name
+        self._new_ids = array('q')
+        self.assigned = 0
+    
+    def assign(self, old_id, new_id):
+        if old_id >= len(self._new_ids):
+            # Crescimento geométrico para não realocar a cada id
+            grow = max(old_id + 1 - len(self._new_ids), len(self._new_ids))
+            self._new_ids.frombytes(bytes(grow * self._new_ids.itemsize))
+        self._new_ids[old_id] = new_id
+        self.assigned += 1
+    
+    def get(self, old_id):
+        """Id de destino, None se o registro não foi migrado; ids não inteiros passam intactos"""
+        if old_id is None:
+            return None
+        if not isinstance(old_id, int):
+            return old_id
+        if 0 <= old_id < len(self._new_ids) and self._new_ids[old_id]:
+            return self._new_ids[old_id]
+        return None
+
+# Ids migrados por tabela de destino (mesmos filtros das fases migrate_*;
+# tickets e messages usam os tickets elegíveis de prepare_source_snapshot,
+# cuja tabela entra no lugar de {eligible})
+REMAP_QUERIES = {
+    'queues': 'SELECT id FROM "Companies" WHERE status = true ORDER BY id',
+    'contacts': 'SELECT id FROM "Contacts" WHERE "companyId" IS NOT NULL ORDER BY id',
+    'users': 'SELECT id FROM "Users" WHERE "companyId" IS NOT NULL ORDER BY id',
+    'whatsapps': 'SELECT id FROM "Whatsapps" ORDER BY id',
+    'tickets': 'SELECT id FROM {eligible} WHERE loadable ORDER BY id',
+    'messages': '''
+        SELECT id FROM "Messages"
+        WHERE "ticketId" IN (SELECT id FROM {eligible})
+        ORDER BY id
+    ''',
+}
+
+REMAP_TARGET_TABLES = {
+    'queues': 'Queues',
+    'contacts': 'Contacts',
+    'users': 'Users',
+    'whatsapps': 'Whatsapps',
+    'tickets': 'Tickets',
+    'messages': 'Messages',
+}
+
+# Extração por tabela de destino: (SELECT com os filtros de elegibilidade, coluna id).
+# As fases acrescentam ORDER BY; a replicação relê as linhas alteradas com "id = ANY(%s)"
+SOURCE_QUERIES = {
+    'Queues': ('''
+        SELECT id, name, "createdAt", "updatedAt", schedules
+        FROM "Companies" 
+        WHERE status = true
+    ''', 'id'),
+    'Contacts': ('''
+        SELECT c.id, c.name, c.number, c."profilePicUrl", c."createdAt", c."updatedAt", 
+               c.email, c."isGroup", c."companyId"
+        FROM "Contacts" c
+        WHERE c."companyId" IS NOT NULL
+    ''', 'c.id'),
+    'Users': ('''
+        SELECT id, name, email, "passwordHash", "createdAt", "updatedAt", profile, "tokenVersion", online
+        FROM "Users"
+        WHERE "companyId" IS NOT NULL
+    ''', 'id'),
+    'Whatsapps': ('''
+        SELECT DISTINCT w.id, w.name, w."createdAt", w."updatedAt", w."isDefault", 
+               w.retries, w."greetingMessage", w."farewellMessage"
+        FROM "Whatsapps" w
+        INNER JOIN "Tickets" t ON t."whatsappId" = w.id
+        WHERE t."companyId" IS NOT NULL
+    ''', 'w.id'),
+    'Tickets': ('''
+        SELECT t.id, t.status, t."lastMessage", t."contactId", t."userId", 
+               t."createdAt", t."updatedAt", t."whatsappId", t."isGroup", 
+               t."unreadMessages", t."companyId"
+        FROM "Tickets" t
+        WHERE t."companyId" IS NOT NULL AND t."contactId" IS NOT NULL
+    ''', 't.id'),
+    'Messages': ('''
+        SELECT m.id, m.body, m.ack, m.read, m."mediaType", m."mediaUrl", 
+               m."ticketId", m."createdAt", m."updatedAt", m."fromMe", 
+               m."isDeleted", m."contactId", m."quotedMsgId"
+        FROM "Messages" m
+        INNER JOIN "Tickets" t ON m."ticketId" = t.id
+        WHERE t."companyId" IS NOT NULL
+    ''', 'm.id'),
+}
+
+# Tickets elegíveis materializados na origem por prepare_source_snapshot:
+# id, loadable (com contactId, o filtro da fase Tickets) e whatsappId. O nome
+# leva um sufixo por execução, para execuções simultâneas na mesma origem
+ELIGIBLE_TICKETS_TABLE = 'migration_eligible_tickets'
+
+# Variantes de SOURCE_QUERIES que leem os tickets elegíveis materializados
+# ({eligible}) em vez de refazer o filtro sobre "Tickets"; a replicação usa
+# SOURCE_QUERIES
+ELIGIBLE_SOURCE_QUERIES = {
+    'Whatsapps': ('''
+        SELECT w.id, w.name, w."createdAt", w."updatedAt", w."isDefault", 
+               w.retries, w."greetingMessage", w."farewellMessage"
+        FROM "Whatsapps" w
+        WHERE w.id IN (SELECT "whatsappId" FROM {eligible})
+    ''', 'w.id'),
+    'Tickets': ('''
+        SELECT t.id, t.status, t."lastMessage", t."contactId", t."userId", 
+               t."createdAt", t."updatedAt", t."whatsappId", t."isGroup", 
+               t."unreadMessages", t."companyId"
+        FROM "Tickets" t
+        WHERE t.id IN (SELECT id FROM {eligible} WHERE loadable)
+    ''', 't.id'),
+    'Messages': ('''
+        SELECT m.id, m.body, m.ack, m.read, m."mediaType", m."mediaUrl", 
+               m."ticketId", m."createdAt", m."updatedAt", m."fromMe", 
+               m."isDeleted", m."contactId", m."quotedMsgId"
+        FROM "Messages" m
+        WHERE m."ticketId" IN (SELECT id FROM {eligible})
+    ''', 'm.id'),
+}
+
+# Colunas de destino, na ordem das linhas produzidas pelas transformações
+TARGET_COLUMNS = {
+    'Queues': ['id', 'name', 'color', 'greetingMessage', 'createdAt', 'updatedAt', 'schedules', 'outOfHoursMessage'],
+    'Contacts': ['id', 'name', 'number', 'profilePicUrl', 'createdAt', 'updatedAt', 'email', 'isGroup'],
+    'Users': ['id', 'name', 'email', 'passwordHash', 'createdAt', 'updatedAt', 'profile', 'tokenVersion', 'whatsappId', 'online'],
+    'Whatsapps': ['id', 'name', 'createdAt', 'updatedAt', 'isDefault', 'retries', 'greetingMessage', 'farewellMessage', 'status', 'battery', 'plugged'],
+    'Tickets': ['id', 'status', 'lastMessage', 'contactId', 'userId', 'createdAt', 'updatedAt', 'whatsappId', 'isGroup', 'unreadMessages', 'queueId'],
+    'Messages': ['id', 'body', 'ack', 'read', 'mediaType', 'mediaUrl', 'ticketId', 'createdAt', 'updatedAt', 'fromMe', 'isDeleted', 'contactId', 'quotedMsgId'],
+}
+
+def target_insert_sql(table, into=None):
+    """INSERT parametrizado com as colunas de destino da tabela (gravando em into, se dado)"""
+    columns = TARGET_COLUMNS[table]
+    return f'''
+        INSERT INTO {into or table} ({', '.join(f'`{column}`' for column in columns)})
+        VALUES ({', '.join(['%s'] * len(columns))})
+    '''
+
+def target_upsert_sql(table, keep=()):
+    """INSERT ... ON DUPLICATE KEY UPDATE; as colunas em keep preservam o valor do destino"""
+    updates = [f'`{column}` = VALUES(`{column}`)' for column in TARGET_COLUMNS[table][1:] if column not in keep]
+    return f"{target_insert_sql(table)} ON DUPLICATE KEY UPDATE {', '.join(updates)}"
+
+# Tabelas de origem acompanhadas pela replicação → tabela de destino
+REPLICATED_TABLES = {
+    'Companies': 'Queues',
+    'Contacts': 'Contacts',
+    'Users': 'Users',
+    'Whatsapps': 'Whatsapps',
+    'Tickets': 'Tickets',
+    'Messages': 'Messages',
+}
+
+# Colunas que a replicação não sobrescreve: estado mantido pelo whaticket
+REPLICATION_KEEP_COLUMNS = {
+    'Queues': ('color',),
+    'Users': ('whatsappId',),
+    'Whatsapps': ('status', 'battery', 'plugged'),
+}
+
+def dedupe_number(number, company_id, taken):
+    """Número único para um contact: sufixo _c{company_id} (e _N) se já estiver em taken"""
+    if number not in taken:
+        return number
+    
+    # Adicionar sufixo baseado no company_id para tornar único
+    candidate = f"{number}_c{company_id}"
+    
+    # Se ainda assim conflitar, adicionar contador
+    attempt = 1
+    while candidate in taken and attempt < 100:
+        candidate = f"{number}_c{company_id}_{attempt}"
+        attempt += 1
+    return candidate
+
+def dedupe_email(email, user_id, taken):
+    """Email único para um user: sufixo _u{user_id} (e _N) antes do @ se já estiver em taken"""
+    if email not in taken:
+        return email
+    
+    # Adicionar sufixo baseado no user_id para tornar único
+    email_parts = email.split('@')
+    if len(email_parts) == 2:
+        candidate = f"{email_parts[0]}_u{user_id}@{email_parts[1]}"
+    else:
+        candidate = f"{email}_u{user_id}"
+    
+    # Se ainda assim conflitar, adicionar contador
+    attempt = 1
+    while candidate in taken and attempt < 100:
+        if len(email_parts) == 2:
+            candidate = f"{email_parts[0]}_u{user_id}_{attempt}@{email_parts[1]}"
+        else:
+            candidate = f"{email}_u{user_id}_{attempt}"
+        attempt += 1
+    return candidate
+
+def color_candidates(company_id, company_name):
+    """Cores tentadas por generate_unique_color, em ordem (hash do id e nome da company)"""
+    # Criar hash único baseado no ID e nome; extrair 6 caracteres hex para formar a cor
+    unique_string = f"company_{company_id}_{company_name}_{company_id * 7}"
+    yield f"#{hashlib.md5(unique_string.encode()).hexdigest()[:6].upper()}"
+    
+    # Variações usadas quando a cor já existe
+    for attempt in range(1, 101):
+        modified_string = f"company_{company_id}_{company_name}_{company_id * 7}_{attempt}"
+        yield f"#{hashlib.md5(modified_string.encode()).hexdigest()[:6].upper()}"
+
+# Candidatos a renomeação, na ordem da carga: valores repetidos ou com cara de
+# sufixo gerado (podem colidir com um). As demais linhas nunca são renomeadas
+# nem interferem nas renomeações, então repetir dedupe_number/dedupe_email só
+# sobre os candidatos dá o mesmo resultado da passada serial completa
+DEDUPE_PLAN_QUERIES = {
+    'numbers': r'''
+        SELECT id, number, "companyId" FROM (
+            SELECT c.id, c.number, c."companyId",
+                   COUNT(*) OVER (PARTITION BY c.number) AS copies
+            FROM "Contacts" c
+            WHERE c."companyId" IS NOT NULL
+        ) contacts
+        WHERE copies > 1 OR number ~ '_c[0-9]+(_[0-9]+)?$'
+        ORDER BY id
+    ''',
+    'emails': r'''
+        SELECT id, email FROM (
+            SELECT id, email,
+                   COUNT(*) OVER (PARTITION BY email) AS copies
+            FROM "Users"
+            WHERE "companyId" IS NOT NULL
+        ) users
+        WHERE copies > 1 OR email ~ '_u[0-9]+(_[0-9]+)?(@[^@]*)?$'
+        ORDER BY id
+    ''',
+}
+
+# Tabela de origem de cada tabela de destino (amostragem da verificação)
+SPOT_CHECK_SOURCE_TABLES = {
+    'Queues': 'Companies',
+    'Contacts': 'Contacts',
+    'Users': 'Users',
+    'Whatsapps': 'Whatsapps',
+    'Tickets': 'Tickets',
+    'Messages': 'Messages',
+}
+
+def wilson_upper_bound(failures, total, z=1.96):
+    """Limite superior do intervalo de Wilson (95% por padrão) para a taxa de falhas"""
+    if total == 0:
+        return 1.0
+    rate = failures / total
+    center = rate + z * z / (2 * total)
+    margin = z * math.sqrt(rate * (1 - rate) / total + z * z / (4 * total * total))
+    return min(1.0, (center + margin) / (1 + z * z / total))
+
+def values_match(expected, actual, column=None):
+    """Compara um campo esperado com o gravado, tolerando diferenças de driver
+    
+    Só a coluna schedules é comparada como JSON; nas demais, texto
+    reformatado é divergência.
+    """
+    if isinstance(actual, (bytes, bytearray)):
+        actual = actual.decode('utf-8', errors='replace')
+    if expected == actual:
+        return True
+    if isinstance(expected, datetime) and isinstance(actual, datetime):
+        # DATETIME do MariaDB não guarda fuso nem (por padrão) microssegundos
+        delta = expected.replace(tzinfo=None) - actual.replace(tzinfo=None)
+        return abs(delta.total_seconds()) < 1
+    if column == 'schedules' and isinstance(expected, str) and isinstance(actual, str):
+        # JSON pode voltar reformatado
+        try:
+            return json.loads(expected) == json.loads(actual)
+        except ValueError:
+            return False
+    return False
+
+class TargetValueSet:
+    """Conjunto de deduplicação apoiado no MariaDB (modo replicação)
+    
+    Um valor está em uso se outra linha do destino já o tem (a linha em
+    atualização, row_id, é ignorada) ou se foi atribuído no lote corrente.
+    Mesma interface do SpillableSet usada por _contact_row/_user_row.
+    """
+    
+    def __init__(self, migration, table, column):
+        self.migration = migration
+        self.table = table
+        self.column = column
+        self.row_id = None
+        self._added = set()
+    
+    def __contains__(self, value):
+        if value in self._added:
+            return True
+        # <=> compara NULL como valor, igual ao conjunto da carga inicial
+        cursor = self.migration.mysql_conn.cursor()
+        cursor.execute(
+            f"SELECT 1 FROM {self.table} WHERE {self.column} <=> %s AND id <> %s LIMIT 1",
+            (value, self.row_id if self.row_id is not None else 0)
+        )
+        found = cursor.fetchone() is not None
+        cursor.close()
+        return found
+    
+    def add(self, value):
+        self._added.add(value)
+
+class ReplicationStream:
+    """Slot de replicação lógica do PostgreSQL (test_decoding ou wal2json)
+    
+    Só as chaves interessam: cada mudança vira (tabela, operação, id) e a
+    linha atual é relida da origem ao aplicar o lote.
+    """
+    
+    TEST_DECODING_CHANGE = re.compile(r'^table (?:\w+|"[^"]+")\.(?:"([^"]+)"|(\w+)): (INSERT|UPDATE|DELETE): (.*)$', re.S)
+    # id inteiro (Tickets) ou literal entre aspas (Messages.id é varchar)
+    TEST_DECODING_ID = re.compile(r"(?:^| )id\[[^\]]+\]:(?:'((?:[^']|'')*)'|(-?\d+))")
+    TEST_DECODING_CONTROL = re.compile(r'^(BEGIN|COMMIT)\b')
+    WAL2JSON_ACTIONS = {'I': 'INSERT', 'U': 'UPDATE', 'D': 'DELETE'}
+    
+    def __init__(self, pg_config, slot_name='whaticket_migration', decoder='test_decoding'):
+        self.pg_config = pg_config
+        self.slot_name = slot_name
+        self.decoder = decoder
+        self.conn = None
+        self.cursor = None
+        self.last_send_time = None
+        self.unparsed = 0
+    
+    def connect(self):
+        import psycopg2.extras
+        self.conn = psycopg2.connect(connection_factory=psycopg2.extras.LogicalReplicationConnection, **self.pg_config)
+        self.cursor = self.conn.cursor()
+    
+    def create_slot(self):
+        """Cria o slot; retorna False se ele já existia (retomada)"""
+        try:
+            self.cursor.create_replication_slot(self.slot_name, output_plugin=self.decoder)
+            logger.info(f"🛰️  Slot de replicação '{self.slot_name}' criado ({self.decoder})")
+            return True
+        except psycopg2.errors.DuplicateObject:
+            logger.info(f"🛰️  Slot de replicação '{self.slot_name}' já existe - retomando")
+            return False
+    
+    def start(self):
+        if self.decoder == 'wal2json':
+            options = {'format-version': '2'}
+        else:
+            options = {'skip-empty-xacts': '1', 'include-xids': '0'}
+        self.cursor.start_replication(slot_name=self.slot_name, decode=True, options=options)
+    
+    def parse(self, payload):
+        """Mensagem do decodificador → lista de (tabela de origem, operação, id)
+        
+        UPDATE que troca a chave primária gera também a mudança do id antigo:
+        relido da origem, ele não existe mais e é removido do destino.
+        Mudanças das tabelas replicadas que não puderem ser interpretadas
+        (sem id, TRUNCATE, formato inesperado) são registradas como erro.
+        """
+        if self.decoder == 'wal2json':
+            change = json.loads(payload)
+            if change.get('action') in ('B', 'C'):
+                return []
+            operation = self.WAL2JSON_ACTIONS.get(change.get('action'))
+            table = change.get('table')
+            if operation is not None:
+                row_id = self._wal2json_id(change.get('identity') if operation == 'DELETE' else change.get('columns'))
+                if row_id is not None:
+                    old_id = self._wal2json_id(change.get('identity')) if operation == 'UPDATE' else None
+                    return self._with_old_id(table, operation, row_id, old_id)
+            if table in REPLICATED_TABLES:
+                self._unparsed(payload)
+            return []
+        
+        if self.TEST_DECODING_CONTROL.match(payload):
+            return []
+        match = self.TEST_DECODING_CHANGE.match(payload)
+        if not match:
+            if any(f'"{table}"' in payload or f'.{table}:' in payload for table in REPLICATED_TABLES):
+                self._unparsed(payload)
+            return []
+        table = match.group(1) or match.group(2)
+        data = match.group(4)
+        old_id = None
+        if data.startswith('old-key: ') and ' new-tuple: ' in data:
+            old_key, data = data.split(' new-tuple: ', 1)
+            old_id = self._test_decoding_id(old_key)
+        row_id = self._test_decoding_id(data)
+        if row_id is None:
+            if table in REPLICATED_TABLES:
+                self._unparsed(payload)
+            return []
+        return self._with_old_id(table, match.group(3), row_id, old_id)
+    
+    def _test_decoding_id(self, data):
+        """Valor da coluna id numa tupla do test_decoding (None se ausente)"""
+        id_match = self.TEST_DECODING_ID.search(data)
+        if not id_match:
+            return None
+        if id_match.group(1) is not None:
+            return id_match.group(1).replace("''", "'")
+        return int(id_match.group(2))
+    
+    def _wal2json_id(self, columns):
+        """Valor da coluna id numa lista de colunas do wal2json (None se ausente)"""
+        for column in columns or ():
+            if column['name'] == 'id':
+                return column['value']
+        return None
+    
+    def _with_old_id(self, table, operation, row_id, old_id):
+        """Mudança do id atual e, se a chave mudou, também a do id antigo"""
+        changes = [(table, operation, row_id)]
+        if old_id is not None and old_id != row_id:
+            changes.append((table, operation, old_id))
+        return changes
+    
+    def _unparsed(self, payload):
+        """Registra uma mudança que a replicação não conseguiu aplicar"""
+        self.unparsed += 1
+        logger.error(f"❌ Mudança não interpretada na replicação (não aplicada): {payload[:300]}")
+    
+    def read(self, max_changes, timeout):
+        """Lê até max_changes mudanças das tabelas replicadas (ou até timeout)
+        
+        Retorna (mudanças, lsn da última mensagem lida ou None).
+        """
+        changes = []
+        last_lsn = None
+        deadline = time.monotonic() + timeout
+        while len(changes) < max_changes:
+            message = self.cursor.read_message()
+            if message is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                select.select([self.cursor], [], [], remaining)
+                continue
+            last_lsn = message.data_start
+            self.last_send_time = message.send_time
+            changes.extend(change for change in self.parse(message.payload) if change[0] in REPLICATED_TABLES)
+        return changes, last_lsn
+    
+    def confirm(self, lsn):
+        """Confirma ao PostgreSQL que tudo até lsn já está no MariaDB"""
+        self.cursor.send_feedback(flush_lsn=lsn)
+    
+    def lag(self, pg_conn):
+        """(bytes de WAL ainda não confirmados, segundos desde a última mensagem)"""
+        pg_cursor = pg_conn.cursor()
+        pg_cursor.execute('''
+            SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), confirmed_flush_lsn)
+            FROM pg_replication_slots WHERE slot_name = %s
+        ''', (self.slot_name,))
+        row = pg_cursor.fetchone()
+        pg_cursor.close()
+        pg_conn.commit()
+        lag_bytes = int(row[0]) if row and row[0] is not None else 0
+        lag_seconds = None
+        if self.last_send_time is not None:
+            lag_seconds = max(0.0, (datetime.now(self.last_send_time.tzinfo) - self.last_send_time).total_seconds())
+        return lag_bytes, lag_seconds
+    
+    def close(self):
+        if self.conn:
+            self.conn.close()
+
+class DatabaseMigration:
+    def __init__(self, defer_quoted_msgs=False, max_memory=None, target_driver='mysql-connector', phase_workers=4, max_rejects=None):
         # Configurações PostgreSQL
         self.pg_config = {
             'host': 'localhost',
@@ -51,7 +975,53 @@ class DatabaseMigration:
         self.pg_conn = None
         self.mysql_conn = None
         self.backup_data = {}
+        self.events = event_summary
+        
+        # Backend do driver MariaDB (mysql-connector, mysqlclient, PyMySQL)
+        self.target_driver = get_target_driver(target_driver)
+        
+        # Carga em duas fases do quotedMsgId (dispensa a ordenação por createdAt)
+        self.defer_quoted_msgs = defer_quoted_msgs
+        
+        # Orçamento de memória: reduz lotes, envia dedupe/backup para disco
+        self.memory_budget = MemoryBudget(max_memory)
+        
+        # Consolidação multi-tenant: remapeamento de ids e estado compartilhado
+        self.source_label = None
+        self.id_remaps = {}
+        self.shared_dedupe_sets = None
+        self.dedupe_lock = threading.Lock()
+        
+        # Renomeações pré-calculadas (plan_dedupe): id de origem → valor final
+        self.dedupe_plans = None
         
+        # Isolamento de falhas por lote: linhas rejeitadas vão para um arquivo
+        self.reject_log = RejectLog()
+        self.batch_retries = 1
+        
+        # Acima deste número de rejeitos a carga é desfeita (None = sem limite);
+        # abaixo dele a carga é mantida, mas a execução termina como falha
+        self.max_rejects = max_rejects
+        
+        # Comandos executados em toda nova conexão com o MariaDB (ex.: replicação)
+        self.session_statements = []
+        
+        # Fases independentes rodam em paralelo (ver MIGRATION_PHASES)
+        self.phase_workers = phase_workers
+        
+        # Cutover priorizado: filtro extra sobre os tickets (alias t) das fases
+        # Tickets e Messages, pausa entre lotes do backfill e citações adiadas
+        # acumuladas entre as cargas de Messages
+        self.ticket_scope = None
+        self.throttle_pause = 0.0
+        self.throttle_threads_running = None
+        self.hold_deferred_quotes = False
+        
+        # Snapshot exportado da origem (prepare_source_snapshot), importado
+        # pelas conexões das fases paralelas, e a tabela de tickets elegíveis
+        self.source_snapshot = None
+        self.eligible_tickets_table = None
+    
     def connect_databases(self):
         """Conecta aos bancos de dados"""
         try:
@@ -61,14 +1031,23 @@ class DatabaseMigration:
             logger.info("✅ Conectado ao PostgreSQL")
             
             # Conexão MariaDB
-            self.mysql_conn = mysql.connector.connect(**self.mysql_config)
-            self.mysql_conn.autocommit = False
-            logger.info("✅ Conectado ao MariaDB")
+            self.mysql_conn = self.connect_target()
+            logger.info(f"✅ Conectado ao MariaDB via {self.target_driver.describe()}")
             
         except Exception as e:
             logger.error(f"❌ Erro ao conectar aos bancos: {e}")
             raise
     
+    def connect_target(self):
+        """Abre uma conexão com o MariaDB usando o driver configurado"""
+        conn = TargetConnection(self.target_driver, self.target_driver.connect(self.mysql_config))
+        if self.session_statements:
+            cursor = conn.cursor()
+            for statement in self.session_statements:
+                cursor.execute(statement)
+            cursor.close()
+        return conn
+    
     def disconnect_databases(self):
         """Desconecta dos bancos de dados"""
         if self.pg_conn:
@@ -78,34 +1057,24 @@ class DatabaseMigration:
             self.mysql_conn.close()
             logger.info("🔌 Desconectado do MariaDB")
     
-    def generate_unique_color(self, company_id, company_name):
-        """Gera uma cor única baseada no ID e nome da company"""
-        # Criar hash único baseado no ID e nome
-        unique_string = f"company_{company_id}_{company_name}_{company_id * 7}"
-        color_hash = hashlib.md5(unique_string.encode()).hexdigest()
+    def generate_unique_color(self, company_id, company_name, assigned=None):
+        """Gera uma cor única baseada no ID e nome da company
         
-        # Extrair 6 caracteres hex para formar a cor
-        color = f"#{color_hash[:6].upper()}"
-        
-        # Verificar se a cor já existe no banco
+        assigned: cores já escolhidas para linhas ainda não gravadas (lote
+        corrente); a cor escolhida é acrescentada a ele.
+        """
+        # Primeira cor candidata que ainda não existe no banco nem no lote (ou a última tentada)
         cursor = self.mysql_conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM Queues WHERE color = %s", (color,))
-        exists = cursor.fetchone()[0] > 0
-        cursor.close()
-        
-        # Se a cor já existe, modificar ligeiramente
-        attempt = 0
-        while exists and attempt < 100:
-            attempt += 1
-            modified_string = f"company_{company_id}_{company_name}_{company_id * 7}_{attempt}"
-            color_hash = hashlib.md5(modified_string.encode()).hexdigest()
-            color = f"#{color_hash[:6].upper()}"
-            
-            cursor = self.mysql_conn.cursor()
+        for color in color_candidates(company_id, company_name):
+            if assigned is not None and color in assigned:
+                continue
             cursor.execute("SELECT COUNT(*) FROM Queues WHERE color = %s", (color,))
-            exists = cursor.fetchone()[0] > 0
-            cursor.close()
+            if cursor.fetchone()[0] == 0:
+                break
+        cursor.close()
         
+        if assigned is not None:
+            assigned.add(color)
         return color
     
     def backup_existing_data(self):
@@ -113,32 +1082,20 @@ class DatabaseMigration:
         logger.info("📦 Fazendo backup dos dados existentes...")
         
         try:
-            cursor = self.mysql_conn.cursor()
-            
-            # Backup Messages
-            cursor.execute("SELECT * FROM Messages")
-            self.backup_data['messages'] = cursor.fetchall()
-            logger.info(f"📦 Backup Messages: {len(self.backup_data['messages'])} registros")
-            
-            # Backup Tickets
-            cursor.execute("SELECT * FROM Tickets")
-            self.backup_data['tickets'] = cursor.fetchall()
-            logger.info(f"📦 Backup Tickets: {len(self.backup_data['tickets'])} registros")
-            
-            # Backup Queues
-            cursor.execute("SELECT * FROM Queues")
-            self.backup_data['queues'] = cursor.fetchall()
-            logger.info(f"📦 Backup Queues: {len(self.backup_data['queues'])} registros")
-            
-            # Backup Contacts
-            cursor.execute("SELECT * FROM Contacts")
-            self.backup_data['contacts'] = cursor.fetchall()
-            logger.info(f"📦 Backup Contacts: {len(self.backup_data['contacts'])} registros")
-            
-            # Backup Users
-            cursor.execute("SELECT * FROM Users")
-            self.backup_data['users'] = cursor.fetchall()
-            logger.info(f"📦 Backup Users: {len(self.backup_data['users'])} registros")
+            cursor = self.mysql_conn.cursor(streaming=True)
+            
+            # Com orçamento de memória o backup vai para disco em vez da RAM
+            for table in ['Messages', 'Tickets', 'Queues', 'Contacts', 'Users']:
+                key = table.lower()
+                cursor.execute(f"SELECT * FROM {table}")
+                self.backup_data[key] = SpilledRows(key) if self.memory_budget.limit else []
+                while True:
+                    rows = cursor.fetchmany(self.memory_budget.scale(5000))
+                    if not rows:
+                        break
+                    for row in rows:
+                        self.backup_data[key].append(row)
+                logger.info(f"📦 Backup {table}: {len(self.backup_data[key])} registros")
             
             cursor.close()
             
@@ -179,55 +1136,468 @@ class DatabaseMigration:
             logger.error(f"❌ Erro ao limpar tabelas: {e}")
             raise
     
+    def _remap(self, key, old_id):
+        """Traduz um id de origem para o id de destino (identidade fora da consolidação)"""
+        remap = self.id_remaps.get(key)
+        if remap is None:
+            return old_id
+        return remap.get(old_id)
+    
+    def _label_name(self, name):
+        """Identifica a origem em nomes únicos no destino (Queues, Whatsapps) ao consolidar"""
+        if self.source_label:
+            return f"{name} [{self.source_label}]"
+        return name
+    
+    def _dedupe_set(self, kind):
+        """Conjunto de deduplicação: compartilhado entre origens na consolidação"""
+        if self.shared_dedupe_sets is not None:
+            return self.shared_dedupe_sets[kind]
+        return SpillableSet(self.memory_budget)
+    
+    def _release_dedupe_set(self, dedupe_set):
+        if self.shared_dedupe_sets is None:
+            dedupe_set.close()
+    
+    def plan_dedupe(self):
+        """Calcula de uma vez as renomeações de números e emails duplicados
+        
+        Só os candidatos de DEDUPE_PLAN_QUERIES passam pelo mesmo algoritmo da
+        carga serial, na mesma ordem; o resultado (id → valor com sufixo) deixa
+        as fases Contacts e Users livres de estado compartilhado.
+        """
+        logger.info("🧮 Planejando renomeação de números e emails duplicados...")
+        
+        plans = {}
+        for kind, query in DEDUPE_PLAN_QUERIES.items():
+            taken = SpillableSet(self.memory_budget)
+            renames = {}
+            candidates = 0
+            
+            pg_cursor = self.pg_conn.cursor(name=f'plan_dedupe_{kind}')
+            pg_cursor.execute(query)
+            for row in self._iter_source_rows(pg_cursor, 10000):
+                candidates += 1
+                if kind == 'numbers':
+                    source_id, number, company_id = row
+                    company_id = self._remap('queues', company_id) or company_id
+                    value = dedupe_number(number, company_id, taken)
+                else:
+                    source_id, email = row
+                    value = dedupe_email(email, self._remap('users', source_id), taken)
+                taken.add(value)
+                if value != row[1]:
+                    renames[source_id] = value
+            pg_cursor.close()
+            taken.close()
+            
+            logger.info(f"🧮 {kind}: {candidates} candidatos, {len(renames)} renomeações")
+            plans[kind] = renames
+        
+        self.dedupe_plans = plans
+        return plans
+    
+    def plan_id_remaps(self, next_ids):
+        """Atribui a esta origem ids de destino sem sobreposição, a partir de next_ids"""
+        logger.info(f"🧭 Planejando ids de destino para a origem '{self.source_label}'...")
+        
+        self.id_remaps = {}
+        for key, query in REMAP_QUERIES.items():
+            remap = IdRemap(key)
+            next_id = next_ids[key]
+            
+            pg_cursor = self.pg_conn.cursor(name=f'plan_{key}')
+            pg_cursor.execute(query.format(eligible=self.eligible_tickets_table))
+            for (old_id,) in self._iter_source_rows(pg_cursor, 10000):
+                if isinstance(old_id, int):
+                    remap.assign(old_id, next_id)
+                    next_id += 1
+            pg_cursor.close()
+            
+            if remap.assigned:
+                logger.info(f"🧭 {REMAP_TARGET_TABLES[key]}: {remap.assigned} ids → {next_ids[key]}..{next_id - 1}")
+            next_ids[key] = next_id
+            self.id_remaps[key] = remap
+        
+        return next_ids
+    
+    def _ensure_mysql_connection(self):
+        """Reconecta ao MariaDB se a conexão caiu"""
+        try:
+            if self.mysql_conn.is_connected():
+                return
+        except Exception:
+            pass
+        logger.warning("🔌 Conexão com o MariaDB perdida - reconectando...")
+        self.mysql_conn = self.connect_target()
+        logger.info("✅ Reconectado ao MariaDB")
+    
+    def _insert_under_savepoint(self, insert_sql, rows):
+        """Insere as linhas sob um SAVEPOINT; em erro desfaz apenas este lote"""
+        # Comandos de controle em cursor texto; os dados no cursor de carga
+        # (protocolo binário quando o driver usa cursores preparados)
+        cursor = self.mysql_conn.cursor()
+        insert_cursor = self.mysql_conn.insert_cursor()
+        try:
+            cursor.execute("SAVEPOINT migration_batch")
+            try:
+                insert_cursor.executemany(insert_sql, rows)
+            except Exception as e:
+                if not self.mysql_conn.is_connection_error(e):
+                    cursor.execute("ROLLBACK TO SAVEPOINT migration_batch")
+                raise
+            cursor.execute("RELEASE SAVEPOINT migration_batch")
+        finally:
+            for open_cursor in (insert_cursor, cursor):
+                try:
+                    open_cursor.close()
+                except Exception:
+                    pass
+    
+    def _load_batch(self, table, insert_sql, rows):
+        """Carrega um lote com isolamento de falhas
+        
+        O lote roda sob SAVEPOINT. Se falhar, é refeito (após reconectar, se a
+        conexão caiu); se falhar de novo, é bissectado até isolar as linhas
+        ruins, que vão para o arquivo de rejeitos. Retorna as linhas carregadas.
+        """
+        if not rows:
+            return 0
+        
+        for attempt in range(self.batch_retries + 1):
+            try:
+                self._insert_under_savepoint(insert_sql, rows)
+                self.mysql_conn.commit()
+                self._throttle()
+                return len(rows)
+            except Exception as e:
+                logger.warning(f"⚠️  Lote de {table} ({len(rows)} registros) falhou na tentativa {attempt + 1}: {e}")
+                self._ensure_mysql_connection()
+        
+        logger.warning(f"🔪 Bissectando lote de {table} para isolar registros com erro...")
+        loaded = self._bisect_batch(table, insert_sql, rows)
+        self.mysql_conn.commit()
+        logger.warning(f"🔪 Lote de {table}: {loaded} carregados, {len(rows) - loaded} rejeitados ({self.reject_log.path})")
+        self._throttle()
+        return loaded
+    
+    def _bisect_batch(self, table, insert_sql, rows):
+        """Divide o lote ao meio recursivamente até isolar as linhas que falham
+        
+        Cada metade carregada é confirmada na hora: uma queda de conexão numa
+        metade seguinte (ex.: linha acima de max_allowed_packet) não desfaz
+        as anteriores já contadas como carregadas.
+        """
+        loaded = 0
+        middle = len(rows) // 2
+        for half in (rows[:middle], rows[middle:]):
+            if not half:
+                continue
+            try:
+                self._insert_under_savepoint(insert_sql, half)
+                self.mysql_conn.commit()
+                loaded += len(half)
+            except Exception as e:
+                self._ensure_mysql_connection()
+                if len(half) == 1:
+                    self.reject_log.record(table, half[0], e)
+                else:
+                    loaded += self._bisect_batch(table, insert_sql, half)
+        return loaded
+    
+    def _throttle(self):
+        """Pausa entre lotes (backfill) para não disputar o MariaDB com a aplicação
+        
+        Além da pausa fixa, espera enquanto o servidor tiver mais threads
+        ativas que throttle_threads_running (até 60s por lote).
+        """
+        if not self.throttle_pause:
+            return
+        time.sleep(self.throttle_pause)
+        
+        waited = 0.0
+        while self.throttle_threads_running and waited < 60:
+            cursor = self.mysql_conn.cursor()
+            cursor.execute("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+            row = cursor.fetchone()
+            cursor.close()
+            if row is None or int(row[1]) <= self.throttle_threads_running:
+                break
+            time.sleep(self.throttle_pause)
+            waited += self.throttle_pause
+    
+    def _ticket_scope_clause(self, ticket_id_column=None):
+        """Filtro de ticket_scope como (trecho AND ..., parâmetros) para as consultas de origem
+        
+        Sem ticket_id_column a condição vale direto sobre "Tickets" t; com ela,
+        vira um IN sobre os tickets que a satisfazem.
+        """
+        if self.ticket_scope is None:
+            return '', None
+        condition, params = self.ticket_scope
+        if ticket_id_column:
+            return f'AND {ticket_id_column} IN (SELECT t.id FROM "Tickets" t WHERE {condition})', tuple(params)
+        return f"AND ({condition})", tuple(params)
+    
+    def _source_query(self, table):
+        """Consulta de extração da tabela: a variante materializada, se preparada"""
+        if self.source_snapshot is not None and table in ELIGIBLE_SOURCE_QUERIES:
+            query, id_column = ELIGIBLE_SOURCE_QUERIES[table]
+            return query.format(eligible=self.eligible_tickets_table), id_column
+        return SOURCE_QUERIES[table]
+    
+    def prepare_source_snapshot(self):
+        """Materializa os tickets elegíveis e exporta um snapshot da origem
+        
+        A tabela UNLOGGED (visível às conexões das fases, ao contrário de uma
+        TEMPORARY) é criada e confirmada primeiro. Em seguida esta conexão abre
+        uma transação REPEATABLE READ e exporta o snapshot, que phase_worker
+        importa: extrações e contagens leem o mesmo estado da origem.
+        """
+        logger.info("🎯 Materializando tickets elegíveis na origem...")
+        
+        # Nome próprio desta execução: outra execução (ou outra entrada da
+        # consolidação) na mesma origem não remove a tabela em uso
+        table = f"{ELIGIBLE_TICKETS_TABLE}_{os.getpid()}_{os.urandom(4).hex()}"
+        
+        pg_cursor = self.pg_conn.cursor()
+        pg_cursor.execute(f'''
+            CREATE UNLOGGED TABLE {table} AS
+            SELECT id, "contactId" IS NOT NULL AS loadable, "whatsappId"
+            FROM "Tickets"
+            WHERE "companyId" IS NOT NULL
+        ''')
+        eligible = pg_cursor.rowcount
+        pg_cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id)")
+        pg_cursor.execute(f"ANALYZE {table}")
+        self.pg_conn.commit()
+        self.eligible_tickets_table = table
+        
+        # A transação exportadora fica aberta enquanto houver fases lendo
+        pg_cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        pg_cursor.execute("SELECT pg_export_snapshot()")
+        self.source_snapshot = pg_cursor.fetchone()[0]
+        pg_cursor.close()
+        
+        logger.info(f"🎯 {eligible} tickets elegíveis em {table} (snapshot {self.source_snapshot})")
+    
+    def release_source_snapshot(self):
+        """Encerra o snapshot compartilhado e remove a tabela de tickets elegíveis"""
+        table = self.eligible_tickets_table
+        self.source_snapshot = None
+        self.eligible_tickets_table = None
+        if table is None or not self.pg_conn or self.pg_conn.closed:
+            return
+        try:
+            self.pg_conn.rollback()
+            pg_cursor = self.pg_conn.cursor()
+            pg_cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            pg_cursor.close()
+            self.pg_conn.commit()
+        except Exception as e:
+            logger.warning(f"⚠️  Não foi possível remover {table}: {e}")
+    
+    def _existing_ids(self, table):
+        """Ids já presentes numa tabela do MariaDB"""
+        cursor = self.mysql_conn.cursor()
+        cursor.execute(f"SELECT id FROM {table}")
+        ids = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        return ids
+    
+    def _iter_source_batches(self, pg_cursor, batch_size):
+        """Lê um cursor do PostgreSQL em lotes, encolhendo-os sob pressão de memória"""
+        while True:
+            rows = pg_cursor.fetchmany(self.memory_budget.scale(batch_size))
+            if not rows:
+                break
+            yield rows
+    
+    def _iter_source_rows(self, pg_cursor, batch_size):
+        """Itera linha a linha sobre um cursor do PostgreSQL lido em lotes"""
+        for batch in self._iter_source_batches(pg_cursor, batch_size):
+            yield from batch
+    
+    def _queue_row(self, company, color=None, assigned_colors=None):
+        """Company do PostgreSQL → linha de Queues"""
+        company_id, name, created_at, updated_at, schedules = company
+        queue_id = self._remap('queues', company_id)
+        
+        # Converter schedules JSONB para texto
+        schedules_text = json.dumps(schedules) if schedules else '[]'
+        
+        # Gerar cor única para esta company
+        if color is None:
+            color = self.generate_unique_color(queue_id, name, assigned_colors)
+        
+        return (
+            queue_id,
+            self._label_name(f"Fila: {name}"),
+            color,
+            f"Bem-vindo à {name}! Como podemos ajudá-lo?",
+            created_at,
+            updated_at,
+            schedules_text,
+            "Estamos fora do horário de atendimento. Deixe sua mensagem que retornaremos em breve."
+        )
+    
+    def _contact_row(self, contact, inserted_numbers=None):
+        """Contact do PostgreSQL → linha de Contacts, com sufixo para números duplicados"""
+        contact_id, name, number, profile_pic, created_at, updated_at, email, is_group, company_id = contact
+        contact_id = self._remap('contacts', contact_id)
+        company_id = self._remap('queues', company_id) or company_id
+        
+        original_number = number
+        
+        if inserted_numbers is None:
+            # Plano pré-calculado (plan_dedupe): consulta simples, sem estado
+            number = self.dedupe_plans['numbers'].get(contact[0], original_number)
+        else:
+            with self.dedupe_lock:
+                number = dedupe_number(original_number, company_id, inserted_numbers)
+                inserted_numbers.add(number)
+        
+        if number != original_number:
+            self.events.record('duplicate_number', contact_id=contact_id, original=original_number, number=number)
+        
+        return (
+            contact_id,
+            name,
+            number,
+            profile_pic,
+            created_at,
+            updated_at,
+            email or '',
+            is_group
+        )
+    
+    def _user_row(self, user, inserted_emails=None):
+        """User do PostgreSQL → linha de Users, com sufixo para emails duplicados"""
+        user_id, name, email, password_hash, created_at, updated_at, profile, token_version, online = user
+        user_id = self._remap('users', user_id)
+        
+        original_email = email
+        
+        if inserted_emails is None:
+            # Plano pré-calculado (plan_dedupe): consulta simples, sem estado
+            email = self.dedupe_plans['emails'].get(user[0], original_email)
+        else:
+            with self.dedupe_lock:
+                email = dedupe_email(original_email, user_id, inserted_emails)
+                inserted_emails.add(email)
+        
+        if email != original_email:
+            self.events.record('duplicate_email', user_id=user_id, original=original_email, email=email)
+        
+        return (
+            user_id,
+            name,
+            email,
+            password_hash,
+            created_at,
+            updated_at,
+            profile,
+            token_version,
+            None,  # whatsappId será nulo inicialmente
+            online
+        )
+    
+    def _whatsapp_row(self, whatsapp):
+        """Whatsapp do PostgreSQL → linha de Whatsapps (desconectado no destino)"""
+        whatsapp_id, name, created_at, updated_at, is_default, retries, greeting_msg, farewell_msg = whatsapp
+        return (
+            self._remap('whatsapps', whatsapp_id),
+            self._label_name(name),
+            created_at,
+            updated_at,
+            is_default,
+            retries,
+            greeting_msg,
+            farewell_msg,
+            'DISCONNECTED',  # status padrão
+            '0%',  # battery padrão
+            False  # plugged padrão
+        )
+    
+    def _ticket_row(self, ticket, existing_whatsapps):
+        """Ticket do PostgreSQL → linha de Tickets; a company vira a fila"""
+        ticket_id, status, last_message, contact_id, user_id, created_at, updated_at, whatsapp_id, is_group, unread_messages, company_id = ticket
+        ticket_id = self._remap('tickets', ticket_id)
+        contact_id = self._remap('contacts', contact_id)
+        user_id = self._remap('users', user_id)
+        whatsapp_id = self._remap('whatsapps', whatsapp_id)
+        queue_id = self._remap('queues', company_id)
+        
+        # Verificar se whatsappId existe na tabela Whatsapps do MariaDB
+        final_whatsapp_id = whatsapp_id
+        if whatsapp_id is not None and whatsapp_id not in existing_whatsapps:
+            final_whatsapp_id = None
+            self.events.record('whatsapp_nulled', ticket_id=ticket_id, whatsapp_id=whatsapp_id)
+        
+        return (
+            ticket_id,
+            status,
+            last_message,
+            contact_id,
+            user_id,
+            created_at,
+            updated_at,
+            final_whatsapp_id,  # NULL se whatsapp não existir
+            is_group,
+            unread_messages,
+            queue_id  # company_id vira queueId
+        )
+    
+    def _message_row(self, message):
+        """Message do PostgreSQL → linha de Messages"""
+        msg_id, body, ack, read, media_type, media_url, ticket_id, created_at, updated_at, from_me, is_deleted, contact_id, quoted_msg_id = message
+        return (
+            self._remap('messages', msg_id),
+            body,
+            ack,
+            read,
+            media_type,
+            media_url,
+            self._remap('tickets', ticket_id),
+            created_at,
+            updated_at,
+            from_me,
+            is_deleted,
+            self._remap('contacts', contact_id),
+            self._remap('messages', quoted_msg_id)
+        )
+    
     def migrate_companies_to_queues(self):
         """Migra Companies do PostgreSQL para Queues no MariaDB"""
         logger.info("🏢 Migrando Companies → Queues...")
         
         try:
             # Buscar companies do PostgreSQL
-            pg_cursor = self.pg_conn.cursor()
-            pg_cursor.execute('''
-                SELECT id, name, "createdAt", "updatedAt", schedules
-                FROM "Companies" 
-                WHERE status = true
-                ORDER BY id
-            ''')
-            companies = pg_cursor.fetchall()
-            
-            logger.info(f"📊 Encontradas {len(companies)} companies para migrar")
+            query, id_column = SOURCE_QUERIES['Queues']
+            pg_cursor = self.pg_conn.cursor(name='migrate_companies')
+            pg_cursor.execute(f"{query} ORDER BY {id_column}")
             
             # Inserir como filas no MariaDB
-            mysql_cursor = self.mysql_conn.cursor()
+            companies_count = 0
+            loaded_count = 0
             
-            for company in companies:
-                company_id, name, created_at, updated_at, schedules = company
-                
-                # Converter schedules JSONB para texto
-                schedules_text = json.dumps(schedules) if schedules else '[]'
-                
-                # Gerar cor única para esta company
-                color = self.generate_unique_color(company_id, name)
+            # Cores escolhidas nesta fase: o lote é escolhido antes de ser gravado
+            assigned_colors = set()
+            
+            for batch in self._iter_source_batches(pg_cursor, 500):
+                companies_count += len(batch)
+                rows = []
                 
-                mysql_cursor.execute('''
-                    INSERT INTO Queues (id, name, color, greetingMessage, createdAt, updatedAt, schedules, outOfHoursMessage)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                ''', (
-                    company_id,
-                    f"Fila: {name}",
-                    color,
-                    f"Bem-vindo à {name}! Como podemos ajudá-lo?",
-                    created_at,
-                    updated_at,
-                    schedules_text,
-                    "Estamos fora do horário de atendimento. Deixe sua mensagem que retornaremos em breve."
-                ))
+                for company in batch:
+                    row = self._queue_row(company, assigned_colors=assigned_colors)
+                    rows.append(row)
+                    self.events.record('queue_created', company_id=company[0], queue_id=row[0], name=company[1], color=row[2])
                 
-                logger.info(f"✅ Company '{name}' → Queue ID {company_id} (cor: {color})")
+                loaded_count += self._load_batch('Queues', target_insert_sql('Queues'), rows)
             
             pg_cursor.close()
-            mysql_cursor.close()
             
-            logger.info(f"✅ Migração Companies → Queues concluída: {len(companies)} registros")
+            logger.info(f"✅ Migração Companies → Queues concluída: {loaded_count}/{companies_count} registros")
             
         except Exception as e:
             logger.error(f"❌ Erro na migração Companies → Queues: {e}")
@@ -238,77 +1608,39 @@ class DatabaseMigration:
         logger.info("👥 Migrando Contacts...")
         
         try:
-            pg_cursor = self.pg_conn.cursor()
-            pg_cursor.execute('''
-                SELECT c.id, c.name, c.number, c."profilePicUrl", c."createdAt", c."updatedAt", 
-                       c.email, c."isGroup", c."companyId"
-                FROM "Contacts" c
-                WHERE c."companyId" IS NOT NULL
-                ORDER BY c.id
-            ''')
-            contacts = pg_cursor.fetchall()
-            
-            logger.info(f"📊 Encontrados {len(contacts)} contacts para migrar")
-            
-            mysql_cursor = self.mysql_conn.cursor()
+            query, id_column = SOURCE_QUERIES['Contacts']
+            pg_cursor = self.pg_conn.cursor(name='migrate_contacts')
+            pg_cursor.execute(f"{query} ORDER BY {id_column}")
             
-            # Rastrear números já inseridos para evitar duplicatas
-            inserted_numbers = set()
+            # Rastrear números já inseridos para evitar duplicatas (dispensado
+            # quando há plano de renomeação)
+            inserted_numbers = None if self.dedupe_plans else self._dedupe_set('numbers')
             duplicates_handled = 0
+            contacts_count = 0
+            loaded_count = 0
             
             batch_size = 1000
-            total_batches = (len(contacts) + batch_size - 1) // batch_size
             
-            for i in range(0, len(contacts), batch_size):
-                batch = contacts[i:i + batch_size]
-                batch_num = (i // batch_size) + 1
+            for batch_num, batch in enumerate(self._iter_source_batches(pg_cursor, batch_size), 1):
+                contacts_count += len(batch)
                 
-                logger.info(f"📦 Processando batch {batch_num}/{total_batches} de contacts ({len(batch)} registros)")
+                logger.info(f"📦 Processando batch {batch_num} de contacts ({len(batch)} registros)")
+                rows = []
                 
                 for contact in batch:
-                    contact_id, name, number, profile_pic, created_at, updated_at, email, is_group, company_id = contact
-                    
-                    original_number = number
-                    
-                    # Se o número já foi inserido, modificar para torná-lo único
-                    if number in inserted_numbers:
-                        # Adicionar sufixo baseado no company_id para tornar único
-                        number = f"{original_number}_c{company_id}"
+                    row = self._contact_row(contact, inserted_numbers)
+                    if row[2] != contact[2]:
                         duplicates_handled += 1
-                        
-                        # Se ainda assim conflitar, adicionar contador
-                        attempt = 1
-                        while number in inserted_numbers and attempt < 100:
-                            number = f"{original_number}_c{company_id}_{attempt}"
-                            attempt += 1
-                        
-                        logger.info(f"📱 Número duplicado: {original_number} → {number} (contact_id: {contact_id})")
-                    
-                    mysql_cursor.execute('''
-                        INSERT INTO Contacts (id, name, number, profilePicUrl, createdAt, updatedAt, email, isGroup)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    ''', (
-                        contact_id,
-                        name,
-                        number,
-                        profile_pic,
-                        created_at,
-                        updated_at,
-                        email or '',
-                        is_group
-                    ))
-                    
-                    # Adicionar à lista de números inseridos
-                    inserted_numbers.add(number)
+                    rows.append(row)
                 
-                # Commit em lotes para melhor performance
-                if batch_num % 5 == 0:  # Commit a cada 5 batches
-                    self.mysql_conn.commit()
+                # Um lote por transação, sob SAVEPOINT
+                loaded_count += self._load_batch('Contacts', target_insert_sql('Contacts'), rows)
             
+            if inserted_numbers is not None:
+                self._release_dedupe_set(inserted_numbers)
             pg_cursor.close()
-            mysql_cursor.close()
             
-            logger.info(f"✅ Migração Contacts concluída: {len(contacts)} registros")
+            logger.info(f"✅ Migração Contacts concluída: {loaded_count}/{contacts_count} registros")
             if duplicates_handled > 0:
                 logger.info(f"📱 Números duplicados tratados: {duplicates_handled}")
             
@@ -321,73 +1653,34 @@ class DatabaseMigration:
         logger.info("👤 Migrando Users...")
         
         try:
-            pg_cursor = self.pg_conn.cursor()
-            pg_cursor.execute('''
-                SELECT id, name, email, "passwordHash", "createdAt", "updatedAt", profile, "tokenVersion", online
-                FROM "Users"
-                WHERE "companyId" IS NOT NULL
-                ORDER BY id
-            ''')
-            users = pg_cursor.fetchall()
+            query, id_column = SOURCE_QUERIES['Users']
+            pg_cursor = self.pg_conn.cursor(name='migrate_users')
+            pg_cursor.execute(f"{query} ORDER BY {id_column}")
             
-            logger.info(f"📊 Encontrados {len(users)} users para migrar")
-            
-            mysql_cursor = self.mysql_conn.cursor()
-            
-            # Rastrear emails já inseridos para evitar duplicatas
-            inserted_emails = set()
+            # Rastrear emails já inseridos para evitar duplicatas (dispensado
+            # quando há plano de renomeação)
+            inserted_emails = None if self.dedupe_plans else self._dedupe_set('emails')
             duplicates_handled = 0
+            users_count = 0
+            loaded_count = 0
             
-            for user in users:
-                user_id, name, email, password_hash, created_at, updated_at, profile, token_version, online = user
+            for batch in self._iter_source_batches(pg_cursor, 1000):
+                users_count += len(batch)
+                rows = []
                 
-                original_email = email
+                for user in batch:
+                    row = self._user_row(user, inserted_emails)
+                    if row[2] != user[2]:
+                        duplicates_handled += 1
+                    rows.append(row)
                 
-                # Se o email já foi inserido, modificar para torná-lo único
-                if email in inserted_emails:
-                    # Adicionar sufixo baseado no user_id para tornar único
-                    email_parts = original_email.split('@')
-                    if len(email_parts) == 2:
-                        email = f"{email_parts[0]}_u{user_id}@{email_parts[1]}"
-                    else:
-                        email = f"{original_email}_u{user_id}"
-                    
-                    duplicates_handled += 1
-                    
-                    # Se ainda assim conflitar, adicionar contador
-                    attempt = 1
-                    while email in inserted_emails and attempt < 100:
-                        if len(email_parts) == 2:
-                            email = f"{email_parts[0]}_u{user_id}_{attempt}@{email_parts[1]}"
-                        else:
-                            email = f"{original_email}_u{user_id}_{attempt}"
-                        attempt += 1
-                    
-                    logger.info(f"📧 Email duplicado: {original_email} → {email} (user_id: {user_id})")
-                
-                mysql_cursor.execute('''
-                    INSERT INTO Users (id, name, email, passwordHash, createdAt, updatedAt, profile, tokenVersion, whatsappId, online)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ''', (
-                    user_id,
-                    name,
-                    email,
-                    password_hash,
-                    created_at,
-                    updated_at,
-                    profile,
-                    token_version,
-                    None,  # whatsappId será nulo inicialmente
-                    online
-                ))
-                
-                # Adicionar à lista de emails inseridos
-                inserted_emails.add(email)
+                loaded_count += self._load_batch('Users', target_insert_sql('Users'), rows)
             
+            if inserted_emails is not None:
+                self._release_dedupe_set(inserted_emails)
             pg_cursor.close()
-            mysql_cursor.close()
             
-            logger.info(f"✅ Migração Users concluída: {len(users)} registros")
+            logger.info(f"✅ Migração Users concluída: {loaded_count}/{users_count} registros")
             if duplicates_handled > 0:
                 logger.info(f"📧 Emails duplicados tratados: {duplicates_handled}")
             
@@ -401,58 +1694,36 @@ class DatabaseMigration:
         
         try:
             # Buscar whatsapps únicos que são referenciados pelos tickets
-            pg_cursor = self.pg_conn.cursor()
-            pg_cursor.execute('''
-                SELECT DISTINCT w.id, w.name, w."createdAt", w."updatedAt", w."isDefault", 
-                       w.retries, w."greetingMessage", w."farewellMessage"
-                FROM "Whatsapps" w
-                INNER JOIN "Tickets" t ON t."whatsappId" = w.id
-                WHERE t."companyId" IS NOT NULL
-                ORDER BY w.id
-            ''')
-            whatsapps = pg_cursor.fetchall()
+            query, id_column = self._source_query('Whatsapps')
+            pg_cursor = self.pg_conn.cursor(name='migrate_whatsapps')
+            pg_cursor.execute(f"{query} ORDER BY {id_column}")
             
-            logger.info(f"📊 Encontrados {len(whatsapps)} whatsapps para migrar")
+            # Whatsapps já existentes no destino (consulta única em vez de uma por linha)
+            existing_whatsapps = self._existing_ids('Whatsapps')
+            whatsapps_count = 0
             
-            if len(whatsapps) == 0:
-                logger.info("✅ Nenhum whatsapp necessário para migrar")
-                return
-            
-            mysql_cursor = self.mysql_conn.cursor()
-            
-            for whatsapp in whatsapps:
-                whatsapp_id, name, created_at, updated_at, is_default, retries, greeting_msg, farewell_msg = whatsapp
-                
-                # Verificar se já existe
-                mysql_cursor.execute("SELECT COUNT(*) FROM Whatsapps WHERE id = %s", (whatsapp_id,))
-                exists = mysql_cursor.fetchone()[0] > 0
-                
-                if not exists:
-                    mysql_cursor.execute('''
-                        INSERT INTO Whatsapps (id, name, createdAt, updatedAt, isDefault, retries, greetingMessage, farewellMessage, status, battery, plugged)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ''', (
-                        whatsapp_id,
-                        name,
-                        created_at,
-                        updated_at,
-                        is_default,
-                        retries,
-                        greeting_msg,
-                        farewell_msg,
-                        'DISCONNECTED',  # status padrão
-                        '0%',  # battery padrão
-                        False  # plugged padrão
-                    ))
+            for batch in self._iter_source_batches(pg_cursor, 500):
+                whatsapps_count += len(batch)
+                rows = []
+                
+                for whatsapp in batch:
+                    row = self._whatsapp_row(whatsapp)
                     
-                    logger.info(f"✅ Whatsapp '{name}' → ID {whatsapp_id}")
-                else:
-                    logger.info(f"⚠️ Whatsapp ID {whatsapp_id} já existe - ignorando")
+                    if row[0] not in existing_whatsapps:
+                        rows.append(row)
+                        self.events.record('whatsapp_created', whatsapp_id=row[0], name=row[1])
+                    else:
+                        self.events.record('whatsapp_skipped', whatsapp_id=row[0], name=row[1])
+                
+                self._load_batch('Whatsapps', target_insert_sql('Whatsapps'), rows)
             
             pg_cursor.close()
-            mysql_cursor.close()
             
-            logger.info(f"✅ Migração Whatsapps concluída: {len(whatsapps)} registros")
+            if whatsapps_count == 0:
+                logger.info("✅ Nenhum whatsapp necessário para migrar")
+                return
+            
+            logger.info(f"✅ Migração Whatsapps concluída: {whatsapps_count} registros")
             
         except Exception as e:
             logger.error(f"❌ Erro na migração Whatsapps: {e}")
@@ -460,73 +1731,40 @@ class DatabaseMigration:
     
     def migrate_tickets(self):
         """Migra Tickets do PostgreSQL para MariaDB, associando à fila correta"""
-        logger.info("🎫 Migrando Tickets...")
-        
-        try:
-            pg_cursor = self.pg_conn.cursor()
-            pg_cursor.execute('''
-                SELECT t.id, t.status, t."lastMessage", t."contactId", t."userId", 
-                       t."createdAt", t."updatedAt", t."whatsappId", t."isGroup", 
-                       t."unreadMessages", t."companyId"
-                FROM "Tickets" t
-                WHERE t."companyId" IS NOT NULL AND t."contactId" IS NOT NULL
-                ORDER BY t.id
-            ''')
-            tickets = pg_cursor.fetchall()
-            
-            logger.info(f"📊 Encontrados {len(tickets)} tickets para migrar")
+        logger.info("🎫 Migrando Tickets...")
+        
+        try:
+            query, id_column = self._source_query('Tickets')
+            scope, scope_params = self._ticket_scope_clause()
+            pg_cursor = self.pg_conn.cursor(name='migrate_tickets')
+            pg_cursor.execute(f"{query} {scope} ORDER BY {id_column}", scope_params)
             
-            mysql_cursor = self.mysql_conn.cursor()
+            # Whatsapps existentes no MariaDB, carregados uma vez
+            existing_whatsapps = self._existing_ids('Whatsapps')
             
             batch_size = 1000
-            total_batches = (len(tickets) + batch_size - 1) // batch_size
             tickets_without_whatsapp = 0
+            tickets_count = 0
+            loaded_count = 0
             
-            for i in range(0, len(tickets), batch_size):
-                batch = tickets[i:i + batch_size]
-                batch_num = (i // batch_size) + 1
+            for batch_num, batch in enumerate(self._iter_source_batches(pg_cursor, batch_size), 1):
+                tickets_count += len(batch)
                 
-                logger.info(f"📦 Processando batch {batch_num}/{total_batches} de tickets ({len(batch)} registros)")
+                logger.info(f"📦 Processando batch {batch_num} de tickets ({len(batch)} registros)")
+                rows = []
                 
                 for ticket in batch:
-                    ticket_id, status, last_message, contact_id, user_id, created_at, updated_at, whatsapp_id, is_group, unread_messages, company_id = ticket
-                    
-                    # Verificar se whatsappId existe na tabela Whatsapps do MariaDB
-                    final_whatsapp_id = whatsapp_id
-                    if whatsapp_id is not None:
-                        mysql_cursor.execute("SELECT COUNT(*) FROM Whatsapps WHERE id = %s", (whatsapp_id,))
-                        whatsapp_exists = mysql_cursor.fetchone()[0] > 0
-                        
-                        if not whatsapp_exists:
-                            final_whatsapp_id = None
-                            tickets_without_whatsapp += 1
-                    
-                    # A company_id vira a queueId no MariaDB
-                    mysql_cursor.execute('''
-                        INSERT INTO Tickets (id, status, lastMessage, contactId, userId, createdAt, updatedAt, whatsappId, isGroup, unreadMessages, queueId)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ''', (
-                        ticket_id,
-                        status,
-                        last_message,
-                        contact_id,
-                        user_id,
-                        created_at,
-                        updated_at,
-                        final_whatsapp_id,  # NULL se whatsapp não existir
-                        is_group,
-                        unread_messages,
-                        company_id  # company_id vira queueId
-                    ))
-                
-                # Commit em lotes para melhor performance
-                if batch_num % 5 == 0:  # Commit a cada 5 batches
-                    self.mysql_conn.commit()
+                    row = self._ticket_row(ticket, existing_whatsapps)
+                    if ticket[7] is not None and row[7] is None:
+                        tickets_without_whatsapp += 1
+                    rows.append(row)
+                
+                # Um lote por transação, sob SAVEPOINT
+                loaded_count += self._load_batch('Tickets', target_insert_sql('Tickets'), rows)
             
             pg_cursor.close()
-            mysql_cursor.close()
             
-            logger.info(f"✅ Migração Tickets concluída: {len(tickets)} registros")
+            logger.info(f"✅ Migração Tickets concluída: {loaded_count}/{tickets_count} registros")
             if tickets_without_whatsapp > 0:
                 logger.info(f"⚠️  Tickets com whatsappId removido (whatsapp não existe): {tickets_without_whatsapp}")
             
@@ -539,118 +1777,296 @@ class DatabaseMigration:
         logger.info("💬 Migrando Messages...")
         
         try:
-            pg_cursor = self.pg_conn.cursor()
-            pg_cursor.execute('''
-                SELECT m.id, m.body, m.ack, m.read, m."mediaType", m."mediaUrl", 
-                       m."ticketId", m."createdAt", m."updatedAt", m."fromMe", 
-                       m."isDeleted", m."contactId", m."quotedMsgId"
-                FROM "Messages" m
-                INNER JOIN "Tickets" t ON m."ticketId" = t.id
-                WHERE t."companyId" IS NOT NULL
-                ORDER BY m."createdAt"
-            ''')
-            messages = pg_cursor.fetchall()
-            
-            logger.info(f"📊 Encontradas {len(messages)} messages para migrar")
-            
-            mysql_cursor = self.mysql_conn.cursor()
+            # Com quotedMsgId adiado a ordem das mensagens não importa mais
+            order_clause = '' if self.defer_quoted_msgs else 'ORDER BY m."createdAt"'
+            
+            query, _ = self._source_query('Messages')
+            scope, scope_params = self._ticket_scope_clause('m."ticketId"')
+            pg_cursor = self.pg_conn.cursor(name='migrate_messages')
+            pg_cursor.execute(f"{query} {scope} {order_clause}", scope_params)
+            
+            if self.defer_quoted_msgs:
+                # Com hold_deferred_quotes a tabela já existe e acumula os pares
+                if self.hold_deferred_quotes:
+                    pending_table = self._pending_quotes_table()
+                else:
+                    pending_table = self._create_pending_quotes_table()
+                pending_sql = f"INSERT INTO {pending_table} (id, quotedMsgId) VALUES (%s, %s)"
+                logger.info("🔗 quotedMsgId adiado: será aplicado após a carga das mensagens")
             
             batch_size = 2000  # Aumentado para melhor performance
-            total_batches = (len(messages) + batch_size - 1) // batch_size
+            messages_count = 0
+            loaded_count = 0
             
-            for i in range(0, len(messages), batch_size):
-                batch = messages[i:i + batch_size]
-                batch_num = (i // batch_size) + 1
+            for batch_num, batch in enumerate(self._iter_source_batches(pg_cursor, batch_size), 1):
+                messages_count += len(batch)
+                
+                logger.info(f"📦 Processando batch {batch_num} de messages ({len(batch)} registros)")
+                rows = []
                 
-                logger.info(f"📦 Processando batch {batch_num}/{total_batches} de messages ({len(batch)} registros)")
+                # Pares (id, quotedMsgId) pendentes deste batch
+                pending_quotes = []
                 
                 for message in batch:
-                    msg_id, body, ack, read, media_type, media_url, ticket_id, created_at, updated_at, from_me, is_deleted, contact_id, quoted_msg_id = message
+                    row = self._message_row(message)
                     
-                    mysql_cursor.execute('''
-                        INSERT INTO Messages (id, body, ack, `read`, mediaType, mediaUrl, ticketId, createdAt, updatedAt, fromMe, isDeleted, contactId, quotedMsgId)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ''', (
-                        msg_id,
-                        body,
-                        ack,
-                        read,
-                        media_type,
-                        media_url,
-                        ticket_id,
-                        created_at,
-                        updated_at,
-                        from_me,
-                        is_deleted,
-                        contact_id,
-                        quoted_msg_id
-                    ))
-                
-                # Commit em lotes para melhor performance
-                if batch_num % 3 == 0:  # Commit a cada 3 batches
-                    self.mysql_conn.commit()
+                    if self.defer_quoted_msgs and row[12] is not None:
+                        pending_quotes.append((row[0], row[12]))
+                        row = row[:12] + (None,)
+                    
+                    rows.append(row)
+                
+                # Um lote por transação, sob SAVEPOINT
+                loaded_count += self._load_batch('Messages', target_insert_sql('Messages'), rows)
+                
+                # Os pares pendentes ficam na tabela de trabalho, não em memória
+                if pending_quotes:
+                    self._load_batch(pending_table, pending_sql, pending_quotes)
+            
+            if self.defer_quoted_msgs and not self.hold_deferred_quotes:
+                self.apply_deferred_quotes()
             
             pg_cursor.close()
-            mysql_cursor.close()
             
-            logger.info(f"✅ Migração Messages concluída: {len(messages)} registros")
+            logger.info(f"✅ Migração Messages concluída: {loaded_count}/{messages_count} registros")
             
         except Exception as e:
             logger.error(f"❌ Erro na migração Messages: {e}")
             raise
     
-    def validate_migration(self):
-        """Valida a migração comparando contadores"""
-        logger.info("🔍 Validando migração...")
+    def _pending_quotes_table(self):
+        """Nome da tabela de trabalho dos quotedMsgId adiados (uma por origem)"""
+        if self.source_label:
+            return f"migration_pending_quotes_{re.sub(r'[^0-9A-Za-z_]', '_', self.source_label)}"
+        return "migration_pending_quotes"
+    
+    def _create_pending_quotes_table(self):
+        """Cria a tabela de trabalho com os pares (id, quotedMsgId) pendentes"""
+        # Tabela comum (não TEMPORARY) para sobreviver a reconexões; CREATE ...
+        # SELECT copia os tipos das colunas de Messages
+        table = self._pending_quotes_table()
+        cursor = self.mysql_conn.cursor()
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(f'''
+            CREATE TABLE {table} (PRIMARY KEY (id))
+            SELECT id, quotedMsgId FROM Messages WHERE 1 = 0
+        ''')
+        cursor.close()
+        return table
+    
+    def apply_deferred_quotes(self, final=True, chunk_size=5000):
+        """Aplica os quotedMsgId adiados com UPDATE ... JOIN e reporta citações pendentes
         
-        try:
-            # Contar registros no PostgreSQL
-            pg_cursor = self.pg_conn.cursor()
+        Os pares são aplicados em faixas de id de até chunk_size, cada uma
+        confirmada e seguida de _throttle(): depois do cutover a tabela
+        Messages já atende a aplicação e não fica travada de uma vez.
+        Com final=False só os pares aplicados saem da tabela de trabalho; os
+        demais aguardam a próxima carga de Messages (backfill).
+        """
+        logger.info("🔗 Aplicando quotedMsgId adiados...")
+        
+        table = self._pending_quotes_table()
+        mysql_cursor = self.mysql_conn.cursor()
+        
+        mysql_cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        pending = mysql_cursor.fetchone()[0]
+        
+        applied = 0
+        lower = None
+        while True:
+            # Limite superior da próxima faixa (percorre a PK da tabela de trabalho)
+            after = '' if lower is None else 'WHERE id > %s'
+            params = None if lower is None else (lower,)
+            mysql_cursor.execute(f"SELECT MAX(id) FROM (SELECT id FROM {table} {after} ORDER BY id LIMIT {chunk_size}) chunk", params)
+            upper = mysql_cursor.fetchone()[0]
+            if upper is None:
+                break
             
-            pg_cursor.execute('SELECT COUNT(*) FROM "Companies" WHERE status = true')
-            pg_companies = pg_cursor.fetchone()[0]
+            # Só aplica citações cuja mensagem citada foi migrada
+            after = '' if lower is None else 'AND p.id > %s'
+            mysql_cursor.execute(f'''
+                UPDATE Messages m
+                INNER JOIN {table} p ON p.id = m.id
+                INNER JOIN Messages q ON q.id = p.quotedMsgId
+                SET m.quotedMsgId = p.quotedMsgId
+                WHERE p.id <= %s {after}
+            ''', (upper,) if lower is None else (upper, lower))
+            applied += mysql_cursor.rowcount
+            self.mysql_conn.commit()
+            self._throttle()
+            lower = upper
+        
+        # Só a contagem; exemplos vêm numa consulta à parte com LIMIT
+        mysql_cursor.execute(f'''
+            SELECT COUNT(*) FROM {table} p
+            LEFT JOIN Messages q ON q.id = p.quotedMsgId
+            WHERE q.id IS NULL
+        ''')
+        dangling = mysql_cursor.fetchone()[0]
+        
+        if not final:
+            mysql_cursor.execute(f'''
+                DELETE p FROM {table} p
+                INNER JOIN Messages q ON q.id = p.quotedMsgId
+            ''')
+            self.mysql_conn.commit()
+            mysql_cursor.close()
+            logger.info(f"🔗 quotedMsgId aplicados: {applied}/{pending} ({dangling} aguardam o backfill)")
+            return dangling
+        
+        examples = []
+        if dangling:
+            mysql_cursor.execute(f'''
+                SELECT p.id, p.quotedMsgId FROM {table} p
+                LEFT JOIN Messages q ON q.id = p.quotedMsgId
+                WHERE q.id IS NULL
+                LIMIT 20
+            ''')
+            examples = mysql_cursor.fetchall()
+        
+        self.mysql_conn.commit()
+        mysql_cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        mysql_cursor.close()
+        
+        logger.info(f"🔗 quotedMsgId aplicados: {applied}/{pending}")
+        if dangling:
+            logger.warning(f"⚠️  Citações pendentes (mensagem citada não migrada): {dangling}")
+            for msg_id, quoted_msg_id in examples:
+                logger.warning(f"   Message {msg_id} → quotedMsgId {quoted_msg_id} inexistente")
+        
+        return dangling
+    
+    def count_source_records(self):
+        """Conta no PostgreSQL os registros elegíveis para migração"""
+        pg_cursor = self.pg_conn.cursor()
+        counts = {}
+        
+        pg_cursor.execute('SELECT COUNT(*) FROM "Companies" WHERE status = true')
+        counts['companies'] = pg_cursor.fetchone()[0]
+        
+        if self.source_snapshot is not None:
+            pg_cursor.execute(f'SELECT COUNT(*) FROM {self.eligible_tickets_table}')
+            counts['tickets'] = pg_cursor.fetchone()[0]
             
+            pg_cursor.execute(f'''
+                SELECT COUNT(*) FROM "Messages"
+                WHERE "ticketId" IN (SELECT id FROM {self.eligible_tickets_table})
+            ''')
+            counts['messages'] = pg_cursor.fetchone()[0]
+        else:
             pg_cursor.execute('SELECT COUNT(*) FROM "Tickets" WHERE "companyId" IS NOT NULL')
-            pg_tickets = pg_cursor.fetchone()[0]
+            counts['tickets'] = pg_cursor.fetchone()[0]
             
             pg_cursor.execute('''
                 SELECT COUNT(*) FROM "Messages" m 
                 INNER JOIN "Tickets" t ON m."ticketId" = t.id 
                 WHERE t."companyId" IS NOT NULL
             ''')
-            pg_messages = pg_cursor.fetchone()[0]
-            
-            pg_cursor.execute('SELECT COUNT(*) FROM "Contacts" WHERE "companyId" IS NOT NULL')
-            pg_contacts = pg_cursor.fetchone()[0]
-            
-            pg_cursor.execute('SELECT COUNT(*) FROM "Users" WHERE "companyId" IS NOT NULL')
-            pg_users = pg_cursor.fetchone()[0]
+            counts['messages'] = pg_cursor.fetchone()[0]
+        
+        pg_cursor.execute('SELECT COUNT(*) FROM "Contacts" WHERE "companyId" IS NOT NULL')
+        counts['contacts'] = pg_cursor.fetchone()[0]
+        
+        pg_cursor.execute('SELECT COUNT(*) FROM "Users" WHERE "companyId" IS NOT NULL')
+        counts['users'] = pg_cursor.fetchone()[0]
+        
+        pg_cursor.close()
+        return counts
+    
+    def count_target_records(self):
+        """Conta no MariaDB os registros migrados"""
+        mysql_cursor = self.mysql_conn.cursor()
+        counts = {}
+        
+        for key, table in [('queues', 'Queues'), ('tickets', 'Tickets'), ('messages', 'Messages'),
+                           ('contacts', 'Contacts'), ('users', 'Users')]:
+            mysql_cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            counts[key] = mysql_cursor.fetchone()[0]
+        
+        mysql_cursor.close()
+        return counts
+    
+    def count_migrated_target_records(self, batch_size=10000):
+        """Conta no MariaDB só as linhas cujos ids vieram da origem
+        
+        Depois do cutover a aplicação também grava no MariaDB; a contagem da
+        tabela inteira incluiria esses registros. Os ids de origem são lidos
+        com os filtros de REMAP_QUERIES (os mesmos de count_source_records).
+        """
+        mysql_cursor = self.mysql_conn.cursor()
+        counts = {}
+        
+        for key in ('queues', 'tickets', 'messages', 'contacts', 'users'):
+            table = REMAP_TARGET_TABLES[key]
+            counts[key] = 0
+            
+            pg_cursor = self.pg_conn.cursor(name=f'validate_{key}')
+            pg_cursor.execute(REMAP_QUERIES[key].format(eligible=self.eligible_tickets_table))
+            for batch in self._iter_source_batches(pg_cursor, batch_size):
+                ids = [self._remap(key, old_id) for (old_id,) in batch]
+                ids = [new_id for new_id in ids if new_id is not None]
+                if not ids:
+                    continue
+                mysql_cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+                counts[key] += mysql_cursor.fetchone()[0]
+            pg_cursor.close()
+        
+        mysql_cursor.close()
+        return counts
+    
+    def validate_migration(self, expected=None, target=None):
+        """Valida a migração comparando contadores
+        
+        expected: contadores de origem já somados (consolidação); por padrão
+        são lidos do PostgreSQL desta instância.
+        target: contadores de destino a comparar (ex.: só os ids migrados,
+        count_migrated_target_records); por padrão, as tabelas inteiras.
+        
+        Retorna se a estrutura está íntegra (contagens com os rejeitos
+        descontados, órfãos, cores e números únicos). Os rejeitos são
+        reportados aqui e tratados por rejects_over_limit.
+        """
+        logger.info("🔍 Validando migração...")
+        
+        try:
+            # Contar registros no PostgreSQL
+            source = expected if expected is not None else self.count_source_records()
+            pg_companies = source['companies']
+            pg_tickets = source['tickets']
+            pg_messages = source['messages']
+            pg_contacts = source['contacts']
+            pg_users = source['users']
+            rejected_total = self.reject_log.total()
             
             # Contar registros no MariaDB
-            mysql_cursor = self.mysql_conn.cursor()
-            
-            mysql_cursor.execute('SELECT COUNT(*) FROM Queues')
-            mysql_queues = mysql_cursor.fetchone()[0]
-            
-            mysql_cursor.execute('SELECT COUNT(*) FROM Tickets')
-            mysql_tickets = mysql_cursor.fetchone()[0]
+            if target is None:
+                target = self.count_target_records()
+            mysql_queues = target['queues']
+            mysql_tickets = target['tickets']
+            mysql_messages = target['messages']
+            mysql_contacts = target['contacts']
+            mysql_users = target['users']
             
-            mysql_cursor.execute('SELECT COUNT(*) FROM Messages')
-            mysql_messages = mysql_cursor.fetchone()[0]
-            
-            mysql_cursor.execute('SELECT COUNT(*) FROM Contacts')
-            mysql_contacts = mysql_cursor.fetchone()[0]
+            mysql_cursor = self.mysql_conn.cursor()
             
-            mysql_cursor.execute('SELECT COUNT(*) FROM Users')
-            mysql_users = mysql_cursor.fetchone()[0]
+            # Validar contadores: cada linha da origem foi carregada ou rejeitada.
+            # Rejeitos não reprovam a estrutura (ver rejects_over_limit)
+            rejected = self.reject_log.counts
+            queues_ok = pg_companies == mysql_queues + rejected.get('Queues', 0)
+            contacts_ok = pg_contacts == mysql_contacts + rejected.get('Contacts', 0)
+            users_ok = pg_users == mysql_users + rejected.get('Users', 0)
+            tickets_ok = pg_tickets == mysql_tickets + rejected.get('Tickets', 0)
+            messages_ok = pg_messages == mysql_messages + rejected.get('Messages', 0)
             
-            # Validar contadores
             logger.info("📊 VALIDAÇÃO DE MIGRAÇÃO:")
-            logger.info(f"   Companies → Queues: {pg_companies} → {mysql_queues} {'✅' if pg_companies == mysql_queues else '❌'}")
-            logger.info(f"   Contacts: {pg_contacts} → {mysql_contacts} {'✅' if pg_contacts == mysql_contacts else '❌'}")
-            logger.info(f"   Users: {pg_users} → {mysql_users} {'✅' if pg_users == mysql_users else '❌'}")
-            logger.info(f"   Tickets: {pg_tickets} → {mysql_tickets} {'✅' if pg_tickets == mysql_tickets else '❌'}")
-            logger.info(f"   Messages: {pg_messages} → {mysql_messages} {'✅' if pg_messages == mysql_messages else '❌'}")
+            logger.info(f"   Registros rejeitados: {rejected_total} {'✅' if rejected_total == 0 else '❌'}")
+            if rejected_total:
+                logger.error(f"   Rejeitados por tabela: {rejected} → {self.reject_log.path}")
+            logger.info(f"   Companies → Queues: {pg_companies} → {mysql_queues} (+{rejected.get('Queues', 0)} rejeitados) {'✅' if queues_ok else '❌'}")
+            logger.info(f"   Contacts: {pg_contacts} → {mysql_contacts} (+{rejected.get('Contacts', 0)} rejeitados) {'✅' if contacts_ok else '❌'}")
+            logger.info(f"   Users: {pg_users} → {mysql_users} (+{rejected.get('Users', 0)} rejeitados) {'✅' if users_ok else '❌'}")
+            logger.info(f"   Tickets: {pg_tickets} → {mysql_tickets} (+{rejected.get('Tickets', 0)} rejeitados) {'✅' if tickets_ok else '❌'}")
+            logger.info(f"   Messages: {pg_messages} → {mysql_messages} (+{rejected.get('Messages', 0)} rejeitados) {'✅' if messages_ok else '❌'}")
             
             # Verificar integridade de FKs
             mysql_cursor.execute('''
@@ -678,33 +2094,32 @@ class DatabaseMigration:
             logger.info(f"   Messages órfãs (sem ticket): {orphaned_messages} {'✅' if orphaned_messages == 0 else '❌'}")
             logger.info(f"   Messages órfãs (sem contact): {orphaned_msg_contacts} {'✅' if orphaned_msg_contacts == 0 else '❌'}")
             
-            # Verificar cores únicas
-            mysql_cursor.execute('SELECT COUNT(DISTINCT color) FROM Queues')
-            unique_colors = mysql_cursor.fetchone()[0]
+            # Verificar cores únicas (na tabela inteira, independente de target)
+            mysql_cursor.execute('SELECT COUNT(*), COUNT(DISTINCT color) FROM Queues')
+            total_queues, unique_colors = mysql_cursor.fetchone()
             
-            logger.info(f"   Cores únicas nas Queues: {unique_colors}/{mysql_queues} {'✅' if unique_colors == mysql_queues else '❌'}")
+            logger.info(f"   Cores únicas nas Queues: {unique_colors}/{total_queues} {'✅' if unique_colors == total_queues else '❌'}")
             
             # Verificar números únicos
-            mysql_cursor.execute('SELECT COUNT(DISTINCT number) FROM Contacts')
-            unique_numbers = mysql_cursor.fetchone()[0]
+            mysql_cursor.execute('SELECT COUNT(*), COUNT(DISTINCT number) FROM Contacts')
+            total_contacts, unique_numbers = mysql_cursor.fetchone()
             
-            logger.info(f"   Números únicos nos Contacts: {unique_numbers}/{mysql_contacts} {'✅' if unique_numbers == mysql_contacts else '❌'}")
+            logger.info(f"   Números únicos nos Contacts: {unique_numbers}/{total_contacts} {'✅' if unique_numbers == total_contacts else '❌'}")
             
-            pg_cursor.close()
             mysql_cursor.close()
             
             # Retornar se validação passou
             validation_passed = (
-                pg_companies == mysql_queues and
-                pg_contacts == mysql_contacts and
-                pg_users == mysql_users and
-                pg_tickets == mysql_tickets and
-                pg_messages == mysql_messages and
+                queues_ok and
+                contacts_ok and
+                users_ok and
+                tickets_ok and
+                messages_ok and
                 orphaned_tickets == 0 and
                 orphaned_messages == 0 and
                 orphaned_msg_contacts == 0 and
-                unique_colors == mysql_queues and
-                unique_numbers == mysql_contacts
+                unique_colors == total_queues and
+                unique_numbers == total_contacts
             )
             
             return validation_passed
@@ -713,6 +2128,160 @@ class DatabaseMigration:
             logger.error(f"❌ Erro na validação: {e}")
             return False
     
+    def rejects_over_limit(self):
+        """Se os rejeitos passaram de max_rejects (a carga deve ser desfeita)"""
+        rejected = self.reject_log.total()
+        if self.max_rejects is not None and rejected > self.max_rejects:
+            logger.error(f"❌ {rejected} registros rejeitados excedem o limite --max-rejects ({self.max_rejects})")
+            return True
+        return False
+    
+    def _sample_source_rows(self, table, sample_size, seed):
+        """Amostra reprodutível de linhas elegíveis da origem
+        
+        TABLESAMPLE BERNOULLI com REPEATABLE(seed) sorteia linha a linha (não
+        blocos inteiros, que concentrariam linhas inseridas juntas), numa
+        fração dimensionada por reltuples com folga para as linhas não
+        elegíveis; a ordem por md5 do id com a semente escolhe as sample_size
+        linhas.
+        """
+        source_table = SPOT_CHECK_SOURCE_TABLES[table]
+        query, id_column = SOURCE_QUERIES[table]
+        
+        pg_cursor = self.pg_conn.cursor()
+        pg_cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", (f'"{source_table}"',))
+        row = pg_cursor.fetchone()
+        estimated = row[0] if row and row[0] and row[0] > 0 else 0
+        percent = min(100.0, 100.0 * sample_size * 3 / estimated) if estimated else 100.0
+        
+        pg_cursor.execute(f'''
+            SELECT * FROM (
+                {query}
+                AND {id_column} IN (SELECT id FROM "{source_table}" TABLESAMPLE BERNOULLI (%s) REPEATABLE (%s))
+            ) sampled
+            ORDER BY md5(sampled.id::text || %s)
+            LIMIT %s
+        ''', (percent, seed, str(seed), sample_size))
+        rows = pg_cursor.fetchall()
+        pg_cursor.close()
+        return rows
+    
+    def _fetch_target_rows(self, table, ids, batch_size=500):
+        """Linhas do MariaDB por id, buscadas em lotes de WHERE id IN (...)"""
+        columns = ', '.join(f'`{column}`' for column in TARGET_COLUMNS[table])
+        ids = list(ids)
+        rows = {}
+        cursor = self.mysql_conn.cursor()
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            cursor.execute(f"SELECT {columns} FROM {table} WHERE id IN ({', '.join(['%s'] * len(batch))})", batch)
+            for row in cursor.fetchall():
+                rows[row[0]] = row
+        cursor.close()
+        return rows
+    
+    def _expected_rows(self, table, source_rows):
+        """Linhas esperadas no destino, pelas mesmas transformações da carga
+        
+        A cor das filas não é recalculada (depende das cores já existentes):
+        vem vazia e é conferida contra color_candidates.
+        """
+        if table == 'Queues':
+            return [self._queue_row(company, color='') for company in source_rows]
+        if table == 'Contacts':
+            return [self._contact_row(contact) for contact in source_rows]
+        if table == 'Users':
+            return [self._user_row(user) for user in source_rows]
+        if table == 'Whatsapps':
+            return [self._whatsapp_row(whatsapp) for whatsapp in source_rows]
+        if table == 'Tickets':
+            existing_whatsapps = self._existing_ids('Whatsapps')
+            return [self._ticket_row(ticket, existing_whatsapps) for ticket in source_rows]
+        
+        rows = [self._message_row(message) for message in source_rows]
+        # Citação de mensagem não migrada fica nula (quotedMsgId adiado) ou
+        # rejeita a mensagem pela FK; em ambos os casos não há quotedMsgId
+        quoted = {row[12] for row in rows if row[12] is not None}
+        present = self._fetch_target_rows('Messages', quoted) if quoted else {}
+        return [row if row[12] is None or row[12] in present else row[:12] + (None,) for row in rows]
+    
+    def spot_check(self, sample_size=200, seed=42, max_examples=5):
+        """Verificação rápida por amostragem, campo a campo
+        
+        Para cada tabela sorteia até sample_size ids elegíveis (reprodutível
+        pela semente), lê as linhas nos dois bancos, aplica as transformações
+        esperadas e compara. Reporta a taxa de divergência com o limite
+        superior de Wilson (95%) e exemplos de ids divergentes.
+        """
+        logger.info(f"🔬 Verificação por amostragem ({sample_size} por tabela, semente {seed})...")
+        
+        events = self.events
+        try:
+            self.connect_databases()
+            
+            # Transformações só calculam o esperado: sem eventos nem renomeações novas
+            self.events = DiscardedEvents()
+            self.plan_dedupe()
+            
+            total_checked = 0
+            total_failed = 0
+            for table in TARGET_COLUMNS:
+                source_rows = self._sample_source_rows(table, sample_size, seed)
+                expected_rows = self._expected_rows(table, source_rows)
+                target_rows = self._fetch_target_rows(table, [row[0] for row in expected_rows])
+                
+                # Estado mantido pelo whaticket não vem da origem
+                skipped = set(REPLICATION_KEEP_COLUMNS.get(table, ())) - {'color'}
+                columns = TARGET_COLUMNS[table]
+                failures = []
+                
+                for source, expected in zip(source_rows, expected_rows):
+                    actual = target_rows.get(expected[0])
+                    if actual is None:
+                        failures.append((expected[0], ['ausente']))
+                        continue
+                    
+                    diffs = []
+                    for column, expected_value, actual_value in zip(columns, expected, actual):
+                        if column in skipped:
+                            continue
+                        if table == 'Queues' and column == 'color':
+                            if actual_value not in set(color_candidates(expected[0], source[1])):
+                                diffs.append(f"color={actual_value!r}")
+                        elif not values_match(expected_value, actual_value, column):
+                            diffs.append(f"{column}: {expected_value!r} ≠ {actual_value!r}")
+                    if diffs:
+                        failures.append((expected[0], diffs))
+                
+                checked = len(expected_rows)
+                total_checked += checked
+                total_failed += len(failures)
+                
+                if checked == 0:
+                    logger.info(f"   {table}: nenhuma linha amostrada")
+                    continue
+                
+                bound = wilson_upper_bound(len(failures), checked)
+                status = '✅' if not failures else '❌'
+                logger.info(f"   {table}: {len(failures)}/{checked} divergentes ({len(failures) / checked:.1%}, ≤ {bound:.1%} com 95% de confiança) {status}")
+                for row_id, diffs in failures[:max_examples]:
+                    logger.info(f"      id {row_id}: {'; '.join(diffs[:3])}")
+            
+            if total_checked:
+                bound = wilson_upper_bound(total_failed, total_checked)
+                logger.info(f"🔬 Total: {total_failed}/{total_checked} divergentes ({total_failed / total_checked:.1%}, ≤ {bound:.1%} com 95% de confiança)")
+            
+            return total_failed == 0
+            
+        except Exception as e:
+            logger.error(f"❌ Erro na verificação por amostragem: {e}")
+            logger.error(f"Stack trace: {traceback.format_exc()}")
+            return False
+            
+        finally:
+            self.events = events
+            self.disconnect_databases()
+    
     def rollback_migration(self):
         """Desfaz a migração restaurando os dados de backup"""
         logger.warning("⏪ Iniciando ROLLBACK da migração...")
@@ -759,15 +2328,13 @@ class DatabaseMigration:
                 messages = self.backup_data['messages']
                 total_batches = (len(messages) + batch_size - 1) // batch_size
                 
-                for i in range(0, len(messages), batch_size):
-                    batch = messages[i:i + batch_size]
-                    batch_num = (i // batch_size) + 1
+                # Iteração sequencial: o backup pode estar em disco (SpilledRows)
+                for i, message in enumerate(messages, 1):
+                    placeholders = ', '.join(['%s'] * len(message))
+                    cursor.execute(f"INSERT INTO Messages VALUES ({placeholders})", message)
                     
-                    for message in batch:
-                        placeholders = ', '.join(['%s'] * len(message))
-                        cursor.execute(f"INSERT INTO Messages VALUES ({placeholders})", message)
-                    
-                    if batch_num % 5 == 0:  # Log a cada 5 batches
+                    batch_num = i // batch_size
+                    if i % batch_size == 0 and batch_num % 5 == 0:  # Log a cada 5 batches
                         logger.info(f"📦 Restaurando Messages: batch {batch_num}/{total_batches}")
                 
                 logger.info(f"📦 Restaurou {len(self.backup_data['messages'])} Messages")
@@ -783,6 +2350,112 @@ class DatabaseMigration:
             logger.error(f"❌ Erro durante o rollback: {e}")
             raise
     
+    def benchmark_target_drivers(self, driver_names, sample_rows=50000, batch_size=2000):
+        """Compara os backends de driver na carga de Messages
+        
+        Lê uma amostra de Messages do PostgreSQL uma única vez e a carrega,
+        com cada driver, pelo mesmo caminho da fase Messages (_message_row e
+        _load_batch com target_insert_sql) numa tabela TEMPORARY criada com
+        LIKE Messages (o destino real não é alterado).
+        """
+        logger.info(f"⏱️  Benchmark de drivers MariaDB: {', '.join(driver_names)} ({sample_rows} messages)")
+        
+        self.pg_conn = psycopg2.connect(**self.pg_config)
+        query, _ = SOURCE_QUERIES['Messages']
+        pg_cursor = self.pg_conn.cursor()
+        pg_cursor.execute(f"{query} LIMIT %s", (sample_rows,))
+        messages = pg_cursor.fetchall()
+        pg_cursor.close()
+        self.pg_conn.close()
+        self.pg_conn = None
+        
+        insert_sql = target_insert_sql('Messages', into='bench_messages')
+        
+        results = []
+        for name in driver_names:
+            # Cópia com o driver da vez (sessão configurada por connect_target) e
+            # rejeitos próprios: o arquivo da última migração real não é tocado
+            bench = copy.copy(self)
+            try:
+                bench.target_driver = get_target_driver(name)
+                bench.mysql_conn = bench.connect_target()
+            except Exception as e:
+                logger.warning(f"⚠️  {name}: indisponível ({e})")
+                continue
+            fd, reject_path = tempfile.mkstemp(prefix=f'migration_bench_rejects_{name}_', suffix='.jsonl')
+            os.close(fd)
+            bench.reject_log = RejectLog(reject_path)
+            
+            description = bench.target_driver.describe()
+            try:
+                cursor = bench.mysql_conn.cursor()
+                cursor.execute("DROP TEMPORARY TABLE IF EXISTS bench_messages")
+                cursor.execute("CREATE TEMPORARY TABLE bench_messages LIKE Messages")
+                cursor.close()
+                
+                loaded = 0
+                started = time.perf_counter()
+                for i in range(0, len(messages), batch_size):
+                    rows = [bench._message_row(message) for message in messages[i:i + batch_size]]
+                    loaded += bench._load_batch('Messages', insert_sql, rows)
+                elapsed = time.perf_counter() - started
+                
+                cursor = bench.mysql_conn.cursor()
+                cursor.execute("DROP TEMPORARY TABLE IF EXISTS bench_messages")
+                cursor.close()
+                
+                rate = loaded / elapsed if elapsed else 0
+                rejected = bench.reject_log.total()
+                results.append((description, elapsed, rate, rejected))
+                logger.info(f"⏱️  {description}: {elapsed:.2f}s ({rate:,.0f} messages/s, {loaded}/{len(messages)} carregadas, {rejected} rejeitadas)")
+            except Exception as e:
+                logger.error(f"❌ {name}: falhou no benchmark ({e})")
+            finally:
+                bench.mysql_conn.close()
+                bench.reject_log.close()
+                if bench.reject_log.total():
+                    logger.warning(f"⚠️  {name}: rejeitos do benchmark em {reject_path}")
+                else:
+                    os.remove(reject_path)
+        
+        if results:
+            logger.info("📊 RESULTADO DO BENCHMARK (Messages):")
+            fastest = min(result[1] for result in results)
+            for description, elapsed, rate, rejected in sorted(results, key=lambda result: result[1]):
+                logger.info(f"   {description}: {elapsed:.2f}s, {rate:,.0f}/s ({elapsed / fastest:.2f}x), {rejected} rejeitadas")
+        
+        return results
+    
+    def phase_worker(self):
+        """Cópia desta migração com conexões próprias, para rodar uma fase em paralelo"""
+        worker = copy.copy(self)
+        worker.pg_conn = psycopg2.connect(**self.pg_config)
+        worker.pg_conn.autocommit = False
+        if self.source_snapshot is not None:
+            pg_cursor = worker.pg_conn.cursor()
+            pg_cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            pg_cursor.execute("SET TRANSACTION SNAPSHOT %s", (self.source_snapshot,))
+            pg_cursor.close()
+        worker.mysql_conn = worker.connect_target()
+        return worker
+    
+    def close_phase_worker(self):
+        """Fecha as conexões de uma cópia criada por phase_worker"""
+        for conn in (self.pg_conn, self.mysql_conn):
+            try:
+                conn.close()
+            except Exception:
+                pass
+    
+    def migrate_all_phases(self):
+        """Executa as fases de migração respeitando as dependências (MIGRATION_PHASES)"""
+        # Na consolidação os conjuntos são compartilhados entre origens; fora
+        # dela o plano dispensa a passada serial
+        if self.shared_dedupe_sets is None and self.dedupe_plans is None:
+            self.plan_dedupe()
+        PhaseScheduler(self, self.phase_workers).run()
+        self.events.flush()
+    
     def run_migration(self, dry_run=False):
         """Executa a migração completa"""
         try:
@@ -793,6 +2466,7 @@ class DatabaseMigration:
             
             # Conectar aos bancos
             self.connect_databases()
+            self.prepare_source_snapshot()
             
             if not dry_run:
                 # Fazer backup dos dados existentes
@@ -802,19 +2476,18 @@ class DatabaseMigration:
                 self.clear_target_tables()
                 
                 # Executar migrações na ordem correta
-                self.migrate_companies_to_queues()
-                self.migrate_contacts()
-                self.migrate_users()
-                self.migrate_whatsapps()  # NOVO: migrar whatsapps antes dos tickets
-                self.migrate_tickets()
-                self.migrate_messages()
-                
-                # Validar migração
+                self.migrate_all_phases()
+                
+                # Validar migração: rejeitos dentro do limite mantêm a carga
                 validation_passed = self.validate_migration()
                 
-                if validation_passed:
+                if validation_passed and not self.rejects_over_limit():
                     # Commit final das transações
                     self.mysql_conn.commit()
+                    rejected = self.reject_log.total()
+                    if rejected:
+                        logger.warning(f"⚠️  MIGRAÇÃO CONCLUÍDA COM {rejected} REGISTROS REJEITADOS - dados mantidos, ver {self.reject_log.path}")
+                        return False
                     logger.info("✅ MIGRAÇÃO CONCLUÍDA COM SUCESSO!")
                     return True
                 else:
@@ -824,35 +2497,17 @@ class DatabaseMigration:
                     return False
             else:
                 # Apenas mostrar estatísticas em modo dry run
-                pg_cursor = self.pg_conn.cursor()
-                
-                pg_cursor.execute('SELECT COUNT(*) FROM "Companies" WHERE status = true')
-                companies_count = pg_cursor.fetchone()[0]
-                
-                pg_cursor.execute('SELECT COUNT(*) FROM "Tickets" WHERE "companyId" IS NOT NULL')
-                tickets_count = pg_cursor.fetchone()[0]
-                
-                pg_cursor.execute('''
-                    SELECT COUNT(*) FROM "Messages" m 
-                    INNER JOIN "Tickets" t ON m."ticketId" = t.id 
-                    WHERE t."companyId" IS NOT NULL
-                ''')
-                messages_count = pg_cursor.fetchone()[0]
-                
-                pg_cursor.execute('SELECT COUNT(*) FROM "Contacts" WHERE "companyId" IS NOT NULL')
-                contacts_count = pg_cursor.fetchone()[0]
-                
-                pg_cursor.execute('SELECT COUNT(*) FROM "Users" WHERE "companyId" IS NOT NULL')
-                users_count = pg_cursor.fetchone()[0]
+                counts = self.count_source_records()
                 
                 logger.info("📊 ESTATÍSTICAS DE MIGRAÇÃO (DRY RUN v3.0):")
-                logger.info(f"   Companies → Queues: {companies_count}")
-                logger.info(f"   Contacts: {contacts_count}")
-                logger.info(f"   Users: {users_count}")
-                logger.info(f"   Tickets: {tickets_count}")
-                logger.info(f"   Messages: {messages_count}")
+                logger.info(f"   Companies → Queues: {counts['companies']}")
+                logger.info(f"   Contacts: {counts['contacts']}")
+                logger.info(f"   Users: {counts['users']}")
+                logger.info(f"   Tickets: {counts['tickets']}")
+                logger.info(f"   Messages: {counts['messages']}")
                 
                 # Verificar duplicatas potenciais
+                pg_cursor = self.pg_conn.cursor()
                 pg_cursor.execute('''
                     SELECT COUNT(*) - COUNT(DISTINCT number) as duplicates
                     FROM "Contacts" WHERE "companyId" IS NOT NULL
@@ -884,16 +2539,692 @@ class DatabaseMigration:
             return False
             
         finally:
+            self.events.flush()
+            self.reject_log.close()
+            self.release_source_snapshot()
+            self.disconnect_databases()
+            self.report_memory()
+    
+    def _fetch_source_rows(self, table, ids):
+        """Relê na origem as linhas elegíveis de uma tabela de destino pelos ids"""
+        query, id_column = SOURCE_QUERIES[table]
+        pg_cursor = self.pg_conn.cursor()
+        pg_cursor.execute(f"{query} AND {id_column} = ANY(%s) ORDER BY {id_column}", (sorted(ids),))
+        rows = pg_cursor.fetchall()
+        pg_cursor.close()
+        return rows
+    
+    def apply_changes(self, changes):
+        """Aplica um lote de mudanças da replicação, na ordem de dependência
+        
+        Só os ids importam: a linha atual é relida da origem e gravada com
+        upsert pelas mesmas transformações da carga inicial (a última operação
+        vence). Ids que sumiram ou deixaram de ser elegíveis são removidos do
+        destino, exceto Whatsapps, que nunca são apagados.
+        """
+        changed = {table: set() for table in TARGET_COLUMNS}
+        for source_table, _operation, row_id in changes:
+            changed[REPLICATED_TABLES[source_table]].add(row_id)
+        
+        # Whatsapps referenciados por tickets alterados precisam existir antes deles
+        if changed['Tickets']:
+            pg_cursor = self.pg_conn.cursor()
+            pg_cursor.execute(
+                'SELECT DISTINCT "whatsappId" FROM "Tickets" WHERE id = ANY(%s) AND "whatsappId" IS NOT NULL',
+                (sorted(changed['Tickets']),)
+            )
+            changed['Whatsapps'].update(row[0] for row in pg_cursor.fetchall())
+            pg_cursor.close()
+        
+        applied = {}
+        for table, ids in changed.items():
+            if not ids:
+                continue
+            
+            source_rows = self._fetch_source_rows(table, ids)
+            rows = []
+            
+            if table == 'Queues':
+                colors = set()
+                rows = [self._queue_row(company, assigned_colors=colors) for company in source_rows]
+            elif table == 'Contacts':
+                numbers = TargetValueSet(self, 'Contacts', 'number')
+                for contact in source_rows:
+                    numbers.row_id = self._remap('contacts', contact[0])
+                    rows.append(self._contact_row(contact, numbers))
+            elif table == 'Users':
+                emails = TargetValueSet(self, 'Users', 'email')
+                for user in source_rows:
+                    emails.row_id = self._remap('users', user[0])
+                    rows.append(self._user_row(user, emails))
+            elif table == 'Whatsapps':
+                rows = [self._whatsapp_row(whatsapp) for whatsapp in source_rows]
+            elif table == 'Tickets':
+                existing_whatsapps = self._existing_ids('Whatsapps')
+                rows = [self._ticket_row(ticket, existing_whatsapps) for ticket in source_rows]
+            else:
+                rows = [self._message_row(message) for message in source_rows]
+            
+            upserted = self._load_batch(table, target_upsert_sql(table, REPLICATION_KEEP_COLUMNS.get(table, ())), rows)
+            
+            gone = sorted(ids - {row[0] for row in source_rows})
+            if gone and table != 'Whatsapps':
+                cursor = self.mysql_conn.cursor()
+                cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(gone))})", gone)
+                cursor.close()
+                self.mysql_conn.commit()
+            else:
+                gone = []
+            
+            applied[table] = (upserted, len(gone))
+        
+        return applied
+    
+    def replicate(self, slot_name='whaticket_migration', decoder='test_decoding', batch_size=1000, interval=5.0, report_every=30.0):
+        """Replicação contínua: carga inicial seguida do consumo do slot lógico
+        
+        O slot é criado antes da carga, para reter as mudanças feitas durante
+        ela; se já existir, a carga é pulada e o consumo é retomado de onde
+        parou. Roda até Ctrl+C.
+        """
+        stream = ReplicationStream(self.pg_config, slot_name, decoder)
+        
+        try:
+            stream.connect()
+            if stream.create_slot():
+                if not self.run_migration(dry_run=False):
+                    logger.error("❌ Carga inicial falhou - removendo o slot de replicação")
+                    stream.cursor.drop_replication_slot(slot_name)
+                    return False
+            
+            # Pais e filhos podem chegar em lotes diferentes: sem checagem de FK
+            self.session_statements = ["SET FOREIGN_KEY_CHECKS = 0"]
+            self.connect_databases()
+            
+            stream.start()
+            logger.info(f"🛰️  Replicação contínua iniciada (slot '{slot_name}', {decoder}) - Ctrl+C para encerrar")
+            
+            applied_total = 0
+            last_report = time.monotonic()
+            while True:
+                changes, lsn = stream.read(batch_size, interval)
+                if changes:
+                    applied = self.apply_changes(changes)
+                    applied_total += len(changes)
+                    summary = ', '.join(f"{table} +{upserted}/-{deleted}" for table, (upserted, deleted) in applied.items())
+                    logger.info(f"🛰️  Lote aplicado ({len(changes)} mudanças): {summary}")
+                
+                # Só confirma depois do commit no MariaDB
+                if lsn is not None:
+                    stream.confirm(lsn)
+                
+                if time.monotonic() - last_report >= report_every:
+                    self.report_replication_lag(stream, applied_total)
+                    self.events.flush()
+                    last_report = time.monotonic()
+            
+        except KeyboardInterrupt:
+            logger.info("⏹️  Replicação encerrada pelo usuário")
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Erro na replicação: {e}")
+            logger.error(f"Stack trace: {traceback.format_exc()}")
+            return False
+            
+        finally:
+            self.events.flush()
+            self.reject_log.close()
+            stream.close()
+            self.disconnect_databases()
+    
+    def report_replication_lag(self, stream, applied_total):
+        """Registra o atraso da replicação: WAL não confirmado e idade da última mensagem"""
+        lag_bytes, lag_seconds = stream.lag(self.pg_conn)
+        if lag_bytes == 0 or lag_seconds is None:
+            age = "em dia" if lag_bytes == 0 else "n/d"
+        else:
+            age = f"{lag_seconds:.1f}s"
+        logger.info(f"🛰️  Replicação: {applied_total} mudanças aplicadas | atraso: {format_size(lag_bytes)} de WAL ({age})")
+        if stream.unparsed:
+            logger.error(f"❌ Replicação: {stream.unparsed} mudanças não interpretadas até agora (ver erros acima)")
+    
+    def reserve_target_ids(self):
+        """Leva o AUTO_INCREMENT de Tickets e Messages além do maior id de origem
+        
+        Registros criados pela aplicação após o cutover não colidem com os
+        ids do histórico que o backfill ainda vai carregar.
+        """
+        pg_cursor = self.pg_conn.cursor()
+        mysql_cursor = self.mysql_conn.cursor()
+        for source_table, table in (('Tickets', 'Tickets'), ('Messages', 'Messages')):
+            pg_cursor.execute(f'SELECT MAX(id) FROM "{source_table}"')
+            max_id = self._remap(table.lower(), pg_cursor.fetchone()[0])
+            if isinstance(max_id, int):
+                mysql_cursor.execute(f"ALTER TABLE {table} AUTO_INCREMENT = {max_id + 1}")
+                logger.info(f"🔒 {table}: AUTO_INCREMENT reservado a partir de {max_id + 1}")
+        mysql_cursor.close()
+        pg_cursor.close()
+    
+    def run_hot_first(self, window_days=7, pause=0.2, max_threads_running=8):
+        """Cutover priorizado: dados quentes primeiro, histórico em backfill
+        
+        Carrega todos os cadastros (Queues, Contacts, Users, Whatsapps) e os
+        tickets abertos/pendentes ou atualizados nos últimos window_days dias,
+        com suas mensagens, e sinaliza que o cutover pode ser feito. Em seguida
+        carrega o restante de Tickets e Messages em lotes espaçados. Depois do
+        sinal a aplicação já escreve no MariaDB: erros no backfill não
+        disparam rollback.
+        """
+        cutover_ready = False
+        try:
+            logger.info(f"🚀 Iniciando migração priorizada (tickets quentes: abertos/pendentes ou dos últimos {window_days} dias)")
+            
+            self.connect_databases()
+            self.prepare_source_snapshot()
+            self.backup_existing_data()
+            self.clear_target_tables()
+            
+            pg_cursor = self.pg_conn.cursor()
+            pg_cursor.execute("SELECT now() - %s * interval '1 day'", (window_days,))
+            cutoff = pg_cursor.fetchone()[0]
+            pg_cursor.close()
+            
+            # COALESCE: status/updatedAt nulos caem no backfill, nunca em nenhum dos dois
+            hot_condition = '''COALESCE(t.status IN ('open', 'pending') OR t."updatedAt" >= %s, false)'''
+            
+            # Citações de mensagens quentes podem apontar para o histórico:
+            # ficam adiadas e são aplicadas conforme as mensagens citadas chegam
+            self.defer_quoted_msgs = True
+            self.hold_deferred_quotes = True
+            self._create_pending_quotes_table()
+            
+            self.ticket_scope = (hot_condition, (cutoff,))
+            self.migrate_all_phases()
+            self.apply_deferred_quotes(final=False)
+            self.reserve_target_ids()
+            
+            hot = self.count_target_records()
+            cutover_ready = True
+            logger.info(f"🟢 PRONTO PARA CUTOVER: {hot['queues']} filas, {hot['contacts']} contacts, {hot['users']} users, "
+                        f"{hot['tickets']} tickets e {hot['messages']} messages quentes migrados - a aplicação já pode ser liberada")
+            self.events.flush()
+            flush_logs()
+            
+            logger.info(f"🐢 Backfill do histórico (pausa de {pause}s por lote, até {max_threads_running} threads ativas no MariaDB)...")
+            self.ticket_scope = (f"NOT {hot_condition}", (cutoff,))
+            self.throttle_pause = pause
+            self.throttle_threads_running = max_threads_running
+            self.migrate_tickets()
+            self.migrate_messages()
+            self.apply_deferred_quotes()
+            
+            self.ticket_scope = None
+            self.throttle_pause = 0.0
+            
+            # A aplicação já grava no MariaDB: no destino contam só os ids migrados
+            logger.info("🔍 Validação final (somente ids vindos da origem; registros criados pela aplicação após o cutover ficam de fora)")
+            validation_passed = self.validate_migration(target=self.count_migrated_target_records())
+            validation_passed = validation_passed and self.reject_log.total() == 0
+            logger.info("✅ BACKFILL CONCLUÍDO!" if validation_passed else "⚠️  Backfill concluído com divergências - verifique a validação")
+            return validation_passed
+            
+        except Exception as e:
+            logger.error(f"❌ Erro durante a migração priorizada: {e}")
+            logger.error(f"Stack trace: {traceback.format_exc()}")
+            
+            if cutover_ready:
+                logger.error("⚠️  Erro no backfill após o cutover: sem rollback (a aplicação já usa o MariaDB)")
+            elif self.mysql_conn:
+                logger.warning("⏪ Executando rollback devido ao erro...")
+                self.mysql_conn.rollback()
+                self.rollback_migration()
+            
+            return False
+            
+        finally:
+            self.events.flush()
+            self.reject_log.close()
+            self.release_source_snapshot()
             self.disconnect_databases()
+            self.report_memory()
+    
+    def report_memory(self):
+        """Registra o pico de RSS no relatório final"""
+        peak = self.memory_budget.peak_rss()
+        if self.memory_budget.limit:
+            within = '✅' if peak <= self.memory_budget.limit else '❌'
+            logger.info(f"📈 Pico de memória (RSS): {format_size(peak)} / orçamento {format_size(self.memory_budget.limit)} {within}")
+        else:
+            logger.info(f"📈 Pico de memória (RSS): {format_size(peak)}")
+
+# Fases de carga: nome → (método, fases que precisam terminar antes). As FKs
+# seguem ativas durante a carga, então cada fase espera as tabelas que referencia
+MIGRATION_PHASES = {
+    'companies': ('migrate_companies_to_queues', ()),
+    'contacts': ('migrate_contacts', ()),
+    'users': ('migrate_users', ()),
+    'whatsapps': ('migrate_whatsapps', ()),
+    'tickets': ('migrate_tickets', ('companies', 'contacts', 'users', 'whatsapps')),
+    'messages': ('migrate_messages', ('tickets', 'contacts')),
+}
+
+class PhaseScheduler:
+    """Executa um DAG de fases, rodando em paralelo as que não dependem entre si
+    
+    Uma fase começa assim que suas dependências terminam. Com mais de um
+    worker cada fase roda numa cópia da migração com conexões próprias
+    (phase_worker); remapeamentos, eventos, rejeitos e orçamento de memória
+    continuam compartilhados. Com workers=1 as fases rodam na própria
+    migração, na ordem em que foram declaradas.
+    """
+    
+    def __init__(self, migration, workers=4, phases=None):
+        self.migration = migration
+        self.workers = max(1, workers)
+        self.phases = phases if phases is not None else MIGRATION_PHASES
+        self.timings = {}
+        self._origin = None
+    
+    def _run_phase(self, name):
+        method, _ = self.phases[name]
+        started = time.monotonic()
+        if self.workers == 1:
+            getattr(self.migration, method)()
+        else:
+            worker = self.migration.phase_worker()
+            try:
+                getattr(worker, method)()
+                worker.mysql_conn.commit()
+            finally:
+                worker.close_phase_worker()
+        return started, time.monotonic()
+    
+    def run(self):
+        """Executa todas as fases; a primeira falha interrompe o agendamento e é relançada"""
+        pending = dict(self.phases)
+        done = set()
+        running = {}
+        first_error = None
+        self._origin = time.monotonic()
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending or running:
+                if first_error is None:
+                    ready = [name for name, (_, deps) in pending.items() if set(deps) <= done]
+                    for name in ready[:self.workers - len(running)]:
+                        del pending[name]
+                        logger.info(f"▶️  Fase {name} iniciada")
+                        running[executor.submit(self._run_phase, name)] = name
+                
+                if not running:
+                    if first_error is None:
+                        raise RuntimeError(f"Dependências circulares ou inexistentes entre as fases: {', '.join(pending)}")
+                    break
+                
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        self.timings[name] = future.result()
+                    except Exception as e:
+                        logger.error(f"❌ Fase {name} falhou: {e}")
+                        if first_error is None:
+                            first_error = e
+                        continue
+                    done.add(name)
+                    started, ended = self.timings[name]
+                    logger.info(f"⏹️  Fase {name} concluída em {ended - started:.1f}s")
+        
+        if first_error is not None:
+            raise first_error
+        
+        self.report_critical_path()
+    
+    def critical_path(self):
+        """Cadeia de fases que limita o tempo total
+        
+        Parte da fase que terminou por último e volta, a cada passo, pela
+        dependência que terminou por último (a que segurou o início da fase).
+        """
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda phase: self.timings[phase][1])
+        path = [name]
+        while True:
+            deps = [dep for dep in self.phases[name][1] if dep in self.timings]
+            if not deps:
+                break
+            name = max(deps, key=lambda dep: self.timings[dep][1])
+            path.append(name)
+        return path[::-1]
+    
+    def report_critical_path(self):
+        path = self.critical_path()
+        if not path:
+            return
+        total = max(ended for _, ended in self.timings.values()) - self._origin
+        steps = ' → '.join(f"{name} ({self.timings[name][1] - self.timings[name][0]:.1f}s)" for name in path)
+        logger.info(f"🧭 Caminho crítico: {steps} | total {total:.1f}s com {self.workers} worker(s)")
+
+def load_sources(path):
+    """Lê a lista de origens PostgreSQL (JSON) para a consolidação
+    
+    Formato: [{"label": "loja1", "host": "...", "port": 5432, "database": "...",
+               "user": "...", "password": "..."}, ...]
+    """
+    with open(path) as sources_file:
+        sources = json.load(sources_file)
+    
+    labels = [source.get('label') for source in sources]
+    if not sources or None in labels or len(set(labels)) != len(labels):
+        raise ValueError("Cada origem precisa de um 'label' único")
+    return sources
+
+class TenantConsolidation:
+    """Consolida vários bancos PostgreSQL whaticket em um único MariaDB
+    
+    Cada origem recebe faixas de ids de destino sem sobreposição (IdRemap) e
+    as origens são migradas em paralelo, cada uma com suas próprias conexões.
+    """
+    
+    def __init__(self, sources, workers=2, **migration_options):
+        self.sources = sources
+        self.workers = max(1, workers)
+        self.migration_options = migration_options
+        self.coordinator = DatabaseMigration(**migration_options)
+        
+        # Números/emails são únicos no destino inteiro, não por origem
+        self.shared_dedupe_sets = {
+            'numbers': SpillableSet(self.coordinator.memory_budget),
+            'emails': SpillableSet(self.coordinator.memory_budget),
+        }
+        self.dedupe_lock = threading.Lock()
+    
+    def _source_migration(self, source):
+        """Cria a migração de uma origem, ligada ao estado compartilhado"""
+        migration = DatabaseMigration(**self.migration_options)
+        migration.pg_config = {key: value for key, value in source.items() if key != 'label'}
+        migration.mysql_config = self.coordinator.mysql_config
+        migration.source_label = source['label']
+        migration.memory_budget = self.coordinator.memory_budget
+        migration.shared_dedupe_sets = self.shared_dedupe_sets
+        migration.dedupe_lock = self.dedupe_lock
+        migration.reject_log = self.coordinator.reject_log
+        return migration
+    
+    def _target_next_ids(self):
+        """Primeiro id livre de cada tabela de destino"""
+        mysql_cursor = self.coordinator.mysql_conn.cursor()
+        next_ids = {}
+        for key, table in REMAP_TARGET_TABLES.items():
+            mysql_cursor.execute(f"SELECT MAX(id) FROM {table}")
+            max_id = mysql_cursor.fetchone()[0]
+            next_ids[key] = (max_id if isinstance(max_id, int) else 0) + 1
+        mysql_cursor.close()
+        return next_ids
+    
+    def _migrate_source(self, migration):
+        logger.info(f"🏬 Origem '{migration.source_label}': iniciando")
+        migration.mysql_conn = migration.connect_target()
+        migration.migrate_all_phases()
+        migration.mysql_conn.commit()
+        counts = migration.count_source_records()
+        logger.info(f"🏬 Origem '{migration.source_label}': concluída")
+        return counts
+    
+    def run(self):
+        """Executa a consolidação completa"""
+        migrations = []
+        try:
+            logger.info(f"🚀 Iniciando consolidação de {len(self.sources)} origens PostgreSQL → MariaDB")
+            
+            self.coordinator.mysql_conn = self.coordinator.connect_target()
+            
+            self.coordinator.backup_existing_data()
+            self.coordinator.clear_target_tables()
+            self.coordinator.mysql_conn.commit()
+            
+            # Planejamento sequencial: cada origem reserva a faixa seguinte de ids
+            next_ids = self._target_next_ids()
+            # Fecha a leitura: sob REPEATABLE READ a conexão continuaria vendo
+            # o destino como estava antes da carga
+            self.coordinator.mysql_conn.commit()
+            for source in self.sources:
+                migration = self._source_migration(source)
+                migration.pg_conn = psycopg2.connect(**migration.pg_config)
+                migration.pg_conn.autocommit = False
+                migration.prepare_source_snapshot()
+                next_ids = migration.plan_id_remaps(next_ids)
+                migrations.append(migration)
+            
+            # Carga paralela das origens
+            expected = {}
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='source') as executor:
+                for counts in executor.map(self._migrate_source, migrations):
+                    for key, value in counts.items():
+                        expected[key] = expected.get(key, 0) + value
+            
+            # Nova transação: a validação precisa ver o que as origens carregaram
+            self.coordinator.mysql_conn.commit()
+            if self.coordinator.validate_migration(expected=expected) and not self.coordinator.rejects_over_limit():
+                self.coordinator.mysql_conn.commit()
+                rejected = self.coordinator.reject_log.total()
+                if rejected:
+                    logger.warning(f"⚠️  CONSOLIDAÇÃO CONCLUÍDA COM {rejected} REGISTROS REJEITADOS - dados mantidos, ver {self.coordinator.reject_log.path}")
+                    return False
+                logger.info("✅ CONSOLIDAÇÃO CONCLUÍDA COM SUCESSO!")
+                return True
+            
+            logger.error("❌ Validação falhou - Executando rollback")
+            self.coordinator.mysql_conn.rollback()
+            self.coordinator.rollback_migration()
+            return False
+            
+        except Exception as e:
+            logger.error(f"❌ Erro durante a consolidação: {e}")
+            logger.error(f"Stack trace: {traceback.format_exc()}")
+            
+            if self.coordinator.mysql_conn:
+                logger.warning("⏪ Executando rollback devido ao erro...")
+                self.coordinator.mysql_conn.rollback()
+                self.coordinator.rollback_migration()
+            
+            return False
+            
+        finally:
+            for migration in migrations:
+                migration.release_source_snapshot()
+                migration.disconnect_databases()
+            for dedupe_set in self.shared_dedupe_sets.values():
+                dedupe_set.close()
+            self.coordinator.events.flush()
+            self.coordinator.reject_log.close()
+            self.coordinator.disconnect_databases()
+            self.coordinator.report_memory()
+
+def parse_args():
+    """Lê as opções de linha de comando"""
+    parser = argparse.ArgumentParser(description="Migração PostgreSQL → MariaDB")
+    parser.add_argument(
+        '--defer-quoted',
+        action='store_true',
+        help='carrega Messages sem quotedMsgId e aplica as citações ao final (dispensa ORDER BY createdAt)'
+    )
+    parser.add_argument(
+        '--max-memory',
+        type=parse_size,
+        default=None,
+        metavar='TAMANHO',
+        help='orçamento de memória (RSS), ex.: 512M ou 2G; lotes encolhem e dedupe/backup vão para disco'
+    )
+    parser.add_argument(
+        '--consolidate',
+        metavar='ORIGENS_JSON',
+        help='consolida vários bancos PostgreSQL (lista JSON de conexões com "label") no MariaDB'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=2,
+        help='origens migradas em paralelo na consolidação (padrão: 2)'
+    )
+    parser.add_argument(
+        '--phase-workers',
+        type=int,
+        default=4,
+        help='fases independentes executadas em paralelo, cada uma com conexões próprias (padrão: 4; 1 = sequencial)'
+    )
+    parser.add_argument(
+        '--max-rejects',
+        type=int,
+        default=None,
+        metavar='N',
+        help='desfaz a carga se mais de N registros forem rejeitados (padrão: sem limite; rejeitos são mantidos no arquivo e a execução termina com falha)'
+    )
+    parser.add_argument(
+        '--driver',
+        choices=list(TARGET_DRIVERS),
+        default='mysql-connector',
+        help='driver do MariaDB de destino (padrão: mysql-connector)'
+    )
+    parser.add_argument(
+        '--benchmark-drivers',
+        nargs='*',
+        choices=list(TARGET_DRIVERS),
+        metavar='DRIVER',
+        help='compara os drivers na carga de Messages (sem argumentos: todos) e sai'
+    )
+    parser.add_argument(
+        '--hot-first',
+        action='store_true',
+        help='migra cadastros e tickets quentes, sinaliza o cutover e faz o backfill do histórico em seguida'
+    )
+    parser.add_argument(
+        '--hot-window-days',
+        type=float,
+        default=7,
+        help='tickets atualizados nesta janela (dias) entram na carga quente (padrão: 7)'
+    )
+    parser.add_argument(
+        '--backfill-pause',
+        type=float,
+        default=0.2,
+        help='pausa em segundos entre lotes do backfill (padrão: 0.2)'
+    )
+    parser.add_argument(
+        '--backfill-max-threads',
+        type=int,
+        default=8,
+        help='o backfill espera enquanto o MariaDB tiver mais threads ativas que isto (padrão: 8)'
+    )
+    parser.add_argument(
+        '--spot-check',
+        type=int,
+        nargs='?',
+        const=200,
+        metavar='N',
+        help='verificação rápida: compara N linhas sorteadas por tabela (padrão: 200) e sai'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=42,
+        help='semente da amostragem de --spot-check (padrão: 42)'
+    )
+    parser.add_argument(
+        '--replicate',
+        action='store_true',
+        help='após a carga inicial, replica continuamente as mudanças via slot de replicação lógica'
+    )
+    parser.add_argument(
+        '--replication-slot',
+        default='whaticket_migration',
+        help='nome do slot de replicação lógica (padrão: whaticket_migration)'
+    )
+    parser.add_argument(
+        '--decoder',
+        choices=['test_decoding', 'wal2json'],
+        default='test_decoding',
+        help='plugin de decodificação lógica do slot (padrão: test_decoding)'
+    )
+    parser.add_argument(
+        '--benchmark-rows',
+        type=int,
+        default=50000,
+        help='messages usadas no benchmark de drivers (padrão: 50000)'
+    )
+    args = parser.parse_args()
+    if args.replicate and args.consolidate:
+        parser.error('--replicate não pode ser combinado com --consolidate')
+    if args.hot_first and (args.consolidate or args.replicate):
+        parser.error('--hot-first não pode ser combinado com --consolidate ou --replicate')
+    return args
 
 def main():
     """Função principal"""
+    args = parse_args()
+    
     print("=" * 70)
     print("🔄 SCRIPT DE MIGRAÇÃO PostgreSQL → MariaDB v4.0")
     print("   Companies → Queues | Tickets + Messages")
     print("   🔧 CORRIGIDO: Whatsapps + Foreign Keys")
     print("=" * 70)
     
+    if args.benchmark_drivers is not None:
+        migration = DatabaseMigration(target_driver=args.driver)
+        migration.benchmark_target_drivers(args.benchmark_drivers or list(TARGET_DRIVERS), args.benchmark_rows)
+        flush_logs()
+        return
+    
+    if args.consolidate:
+        consolidation = TenantConsolidation(
+            load_sources(args.consolidate),
+            workers=args.workers,
+            defer_quoted_msgs=args.defer_quoted,
+            max_memory=args.max_memory,
+            target_driver=args.driver,
+            phase_workers=args.phase_workers,
+            max_rejects=args.max_rejects
+        )
+        success = consolidation.run()
+        flush_logs()
+        print("\n" + "=" * 70)
+        print("✅ CONSOLIDAÇÃO CONCLUÍDA!" if success else "❌ CONSOLIDAÇÃO FALHOU!")
+        print("📋 Verifique o arquivo 'migration.log' para detalhes completos.")
+        print("=" * 70)
+        return
+    
+    if args.spot_check is not None:
+        migration = DatabaseMigration(target_driver=args.driver)
+        success = migration.spot_check(args.spot_check, args.seed)
+        flush_logs()
+        print("\n" + "=" * 70)
+        print("✅ AMOSTRA SEM DIVERGÊNCIAS!" if success else "❌ AMOSTRA COM DIVERGÊNCIAS!")
+        print("📋 Verifique o arquivo 'migration.log' para detalhes completos.")
+        print("=" * 70)
+        return
+    
+    if args.hot_first:
+        migration = DatabaseMigration(max_memory=args.max_memory, target_driver=args.driver, phase_workers=args.phase_workers)
+        success = migration.run_hot_first(args.hot_window_days, args.backfill_pause, args.backfill_max_threads)
+        flush_logs()
+        print("\n" + "=" * 70)
+        print("✅ MIGRAÇÃO PRIORIZADA CONCLUÍDA!" if success else "❌ MIGRAÇÃO PRIORIZADA COM PROBLEMAS!")
+        print("📋 Verifique o arquivo 'migration.log' para detalhes completos.")
+        print("=" * 70)
+        return
+    
+    if args.replicate:
+        migration = DatabaseMigration(defer_quoted_msgs=args.defer_quoted, max_memory=args.max_memory, target_driver=args.driver, phase_workers=args.phase_workers)
+        success = migration.replicate(args.replication_slot, args.decoder)
+        flush_logs()
+        print("\n" + "=" * 70)
+        print("✅ REPLICAÇÃO ENCERRADA!" if success else "❌ REPLICAÇÃO FALHOU!")
+        print("📋 Verifique o arquivo 'migration.log' para detalhes completos.")
+        print("=" * 70)
+        return
+    
     # Perguntar se quer executar em modo dry run
     while True:
         choice = input("\n🔍 Executar em modo DRY RUN primeiro? (s/n): ").lower().strip()
@@ -907,8 +3238,9 @@ def main():
             print("❌ Resposta inválida. Digite 's' para sim ou 'n' para não.")
     
     # Executar migração
-    migration = DatabaseMigration()
+    migration = DatabaseMigration(defer_quoted_msgs=args.defer_quoted, max_memory=args.max_memory, target_driver=args.driver, phase_workers=args.phase_workers, max_rejects=args.max_rejects)
     success = migration.run_migration(dry_run=dry_run)
+    flush_logs()
     
     if dry_run and success:
         print("\n" + "=" * 70)
@@ -917,8 +3249,9 @@ def main():
         while True:
             choice = input("\n🚀 Executar migração real agora? (s/n): ").lower().strip()
             if choice in ['s', 'sim', 'y', 'yes']:
-                migration_real = DatabaseMigration()
+                migration_real = DatabaseMigration(defer_quoted_msgs=args.defer_quoted, max_memory=args.max_memory, target_driver=args.driver, phase_workers=args.phase_workers, max_rejects=args.max_rejects)
                 success_real = migration_real.run_migration(dry_run=False)
+                flush_logs()
                 if success_real:
                     print("\n🎉 MIGRAÇÃO CONCLUÍDA COM SUCESSO!")
                     print("📋 Dados migrados:")